@@ -1,7 +1,22 @@
+import importlib
 from .general import *
-from . import image
-from . import plot
+
+# Submodules that pull in heavy dependencies (matplotlib, ffmpeg, scipy.ndimage)
+# are only imported on first attribute access, so `import pjmstools` stays cheap.
+_LAZY_SUBMODULES = ("image", "plot")
+
+
+def __getattr__(name: str):
+    if name in _LAZY_SUBMODULES:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_LAZY_SUBMODULES))
 
 
 AUTHOR = "Piet J.M. Swinkels"
-LICENSE = "GPL3"
\ No newline at end of file
+LICENSE = "GPL3"
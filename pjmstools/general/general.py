@@ -1,30 +1,147 @@
 import numpy as np
-import pandas as pd
 from typing import Any, Hashable
 from collections.abc import Iterable
 import numpy.typing as npt
 
-def closest_key_in_a_dict(target: float, my_dict: dict[float,Any]) -> tuple[float,Any]:
+class NearestIndex:
     """
-    Find the key in a dict closest in numerical value to the target
+    Index of numerical values for fast nearest-value lookups.
+
+    Sorts the values once, after which (vectorised) queries are answered with a binary search in O(log N) per target, instead of scanning all values. Queries return *positions* in the original (insertion) order, so the index can sit next to a list, or the keys of a dict. If several values are equally close, the one that came first wins, just like a linear scan with `min`.
 
     Parameters
     ----------
-    target : float
+    values : array_like
+        1D collection of numbers to index, e.g. a list, an array or (the keys of) a dict.
+
+    Examples
+    --------
+    >>> index = NearestIndex([5.0, 1.0, 3.0])
+    >>> index.query(2.9)
+    2
+    >>> index.query([0, 4.5])
+    array([1, 0])
+    """
+
+    def __init__(self, values: Iterable[float] | npt.ArrayLike) -> None:
+        # The values as given (not converted by numpy), e.g. to return the exact keys of a dict. None for arrays.
+        self._originals: list[Any] | None = None
+        if not isinstance(values, np.ndarray):
+            self._originals = list(values)  # e.g. the keys of a dict, or a generator
+            values = self._originals
+        values = np.asarray(values).ravel()
+        self._values = values
+        self._order = np.argsort(values, kind="stable")
+        self._sorted = values[self._order]
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    def insert(self, values: Iterable[float] | npt.ArrayLike | float) -> None:
+        """
+        Add values to the index. They get positions after the existing ones, in the given order.
+        """
+        if not isinstance(values, np.ndarray):
+            values = list(values) if is_iter(values) else [values]
+        if self._originals is not None:
+            self._originals.extend(values.ravel().tolist() if isinstance(values, np.ndarray) else values)
+        values = np.asarray(values).ravel()
+        new_order = np.argsort(values, kind="stable")
+        new_sorted = values[new_order]
+        # side="right" puts new values after equal existing ones, which keeps first-wins ties.
+        at = np.searchsorted(self._sorted, new_sorted, side="right")
+        dtype = np.result_type(self._sorted, new_sorted)
+        self._sorted = np.insert(self._sorted.astype(dtype, copy=False), at, new_sorted)
+        self._values = np.concatenate([self._values.astype(dtype, copy=False), values])
+        self._order = np.insert(self._order, at, new_order + len(self._order))
+
+    def query(
+        self, targets: float | npt.ArrayLike, k: int = 1
+    ) -> int | npt.NDArray[np.intp]:
+        """
+        Find the position(s) of the value(s) closest to each target.
+
+        Parameters
+        ----------
+        targets : float | array_like
+            Value(s) to look up.
+        k : int, optional
+            Number of nearest values to return per target, by default 1.
+
+        Returns
+        -------
+        int | np.ndarray
+            Position of the nearest value for a scalar target with k=1. Otherwise an array of shape targets.shape (k=1) or (*targets.shape, k), with the neighbours ordered from near to far (ties go to the earlier position).
+        """
+        n = len(self)
+        if n == 0:
+            raise ValueError("Cannot query an empty NearestIndex.")
+        if not 1 <= k <= n:
+            raise ValueError(f"k must be between 1 and {n}, got {k}.")
+        t = np.asarray(targets)
+        s = self._sorted
+        i = np.searchsorted(s, t, side="left")
+        if k == 1:
+            # s[i] is the first of its run of equal values; look up the first of the run below.
+            upper = np.minimum(i, n - 1)
+            lower = np.searchsorted(s, s[np.maximum(i - 1, 0)], side="left")
+            d_upper = np.where(i < n, np.abs(s[upper] - t), np.inf)
+            d_lower = np.where(i > 0, np.abs(s[lower] - t), np.inf)
+            p_upper = self._order[upper]
+            p_lower = self._order[lower]
+            take_lower = (d_lower < d_upper) | ((d_lower == d_upper) & (p_lower < p_upper))
+            positions = np.where(take_lower, p_lower, p_upper)
+            return int(positions) if positions.ndim == 0 else positions
+        # The k nearest values lie within k places of the insertion point. Equal values are sorted by position, so
+        # for first-wins ties the run of values equal to s[i-k] is also searched from its start.
+        window = i[..., np.newaxis] + np.arange(-k, k)
+        run_start = np.searchsorted(s, s[np.maximum(i - k, 0)], side="left")
+        run = run_start[..., np.newaxis] + np.arange(k)
+        candidates = np.concatenate([run, window], axis=-1)
+        valid = np.concatenate([run < (i - k)[..., np.newaxis], (window >= 0) & (window < n)], axis=-1)
+        candidates = np.clip(candidates, 0, n - 1)
+        distance = np.where(valid, np.abs(s[candidates] - t[..., np.newaxis]), np.inf)
+        positions = self._order[candidates]
+        nearest = np.lexsort((positions, distance), axis=-1)[..., :k]
+        return np.take_along_axis(positions, nearest, axis=-1)
+
+    def nearest(
+        self, targets: float | npt.ArrayLike, k: int = 1
+    ) -> float | npt.NDArray[Any]:
+        """
+        Like `query`, but returns the closest value(s) themselves instead of their positions.
+        """
+        return self._values[self.query(targets, k=k)]
+
+
+def closest_key_in_a_dict(
+    target: float | npt.ArrayLike, my_dict: dict[float,Any], index: NearestIndex | None = None
+) -> tuple[float,Any] | list[tuple[float,Any]]:
+    """
+    Find the key in a dict closest in numerical value to the target. If multiple keys are equally close, returns the first one.
+
+    Parameters
+    ----------
+    target : float | array_like
+        Value to look up, or an array of values, in which case a list of pairs is returned.
     my_dict : dict
+    index : NearestIndex, optional
+        Prebuilt `NearestIndex(my_dict)`. Pass this when looking up targets in the same dict repeatedly, so the keys are only listed and sorted once. The keys are then taken from the index, so it must match the dict.
 
     Returns
     -------
-    tuple[float,any]
-        tuple with closest key, value pair.
+    tuple[float,any] | list[tuple[float,any]]
+        tuple with closest key, value pair (a list of them for an array of targets).
     """
-    closest_key_distance = np.inf
-    for k in my_dict.keys(): # probably can be vectorized, burt don't feel like doing that now.
-        if abs(k-target) < closest_key_distance:
-            closest_key = k
-            closest_key_distance = abs(k - target)
-    closest_value = my_dict[closest_key]
-    return closest_key, closest_value
+    if index is None:
+        index = NearestIndex(my_dict)
+    # the dict's own keys: converting them to numpy can change them (1 -> 1.0, or 2**60 + 1 -> 2.0**60)
+    keys = index._originals if index._originals is not None else list(my_dict)
+    positions = index.query(target)
+    if np.ndim(positions) == 0:
+        closest_key = keys[positions]
+        return closest_key, my_dict[closest_key]
+    return [(keys[i], my_dict[keys[i]]) for i in positions.ravel().tolist()]
 
 
 def inverse_dict_lists(to_invert: dict[Any, Hashable]) -> dict[list[Hashable],Any]:
@@ -50,71 +167,312 @@ def binedges_to_bincenters(bins: Iterable[Any]) -> npt.ArrayLike:
     """
     Converts edges of bins of histogram to centers. Is a secret alias for running_average. Just throw in the binedges as you get them from np.histogram() or others, and you get the centers back.
     """
-    return running_average(bins,2)
+    # Bin edges never contain NaNs, so skip the NaN handling of running_average and work on views of `bins` directly.
+    centers, _ = _rolling_moments(bins, 2)
+    return centers
+
+
+# Up to this window size, windows are summed directly (N passes over the data); above it, blocked prefix sums are used (a fixed number of passes).
+# The variance needs a second direct pass, so it switches over at a smaller window.
+_ROLLING_DIRECT_MAX_WINDOW = 16
+_ROLLING_DIRECT_MAX_WINDOW_VAR = 10
+# Number of samples _rolling_blocked works on at once; small enough for its temporaries to stay in cache.
+_ROLLING_GROUP_SIZE = 2**16
+
+
+def _rolling_moments(
+    x: list[float] | npt.ArrayLike | tuple[float],
+    N: int,
+    axis: int = -1,
+    ddof: int | None = None,
+    pad: bool = False,
+) -> tuple[npt.NDArray[np.floating], npt.NDArray[np.floating] | None]:
+    """
+    Rolling mean, and variance if `ddof` is given, over windows of N datapoints along `axis`.
+
+    This is the engine behind running_average and running_std, in pure numpy. Both methods used (see _rolling_direct and _rolling_blocked) compute the variance around a local reference rather than from raw sums of squares, so it stays accurate for data with a large offset. Sums are accumulated in float64; the output keeps the float dtype of the input (float64 for integers). Like pandas, windows containing NaN or inf give NaN.
+
+    Parameters
+    ----------
+    x : list-like
+        Data, can be N-dimensional.
+    N : int
+        Window size.
+    axis : int, optional
+        Axis to roll along, by default -1.
+    ddof : int | None, optional
+        Delta degrees of freedom of the variance, by default None (don't compute the variance).
+    pad : bool, optional
+        If True, the output has the same length as `x` along `axis`, with the first N-1 points NaN (like pandas). If False (default), only the len - N + 1 complete windows are returned.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray | None]
+        Rolling mean and rolling variance (None if `ddof` is None).
+    """
+    if N < 1:
+        raise ValueError(f"Window size N must be at least 1, got {N}.")
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    out_dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.dtype(np.float64)
+    n_out = max(x.shape[-1] - N + 1, 0)
+    n_total = x.shape[-1] if pad else n_out
+
+    def _allocate() -> tuple[np.ndarray, np.ndarray]:
+        full = np.empty(x.shape[:-1] + (n_total,))
+        full[..., :n_total - n_out] = np.nan
+        return full, full[..., n_total - n_out:]
+
+    mean_full, mean = _allocate()
+    var_full, var = _allocate() if ddof is not None else (None, None)
+    if N <= (_ROLLING_DIRECT_MAX_WINDOW if ddof is None else _ROLLING_DIRECT_MAX_WINDOW_VAR):
+        _rolling_direct(x, N, mean, var)
+    else:
+        _rolling_blocked(x, N, mean, var)
+
+    if var_full is not None:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            var /= N - ddof
+        var_full = np.moveaxis(var_full.astype(out_dtype, copy=False), -1, axis)
+    mean_full = np.moveaxis(mean_full.astype(out_dtype, copy=False), -1, axis)
+    return mean_full, var_full
+
+
+def _rolling_direct(
+    x: np.ndarray, N: int, mean: np.ndarray, m2: np.ndarray | None
+) -> None:
+    """
+    Rolling mean and sum of squared deviations along the last axis of x, written into `mean` and `m2` (if not None).
+
+    Sums N shifted views of x (no copies of the input), then takes the squared deviations in a second pass around each window's own mean. O(N) passes, so only used for small windows.
+    """
+    n_out = mean.shape[-1]
+    windows = [x[..., k:k + n_out] for k in range(N)]
+    mean[...] = 0
+    for window in windows:
+        mean += window
+    mean /= N
+    bad = ~np.isfinite(mean)
+    if bad.any():
+        mean[bad] = np.nan
+    if m2 is not None:
+        m2[...] = 0
+        for window in windows:
+            deviation = window - mean
+            deviation *= deviation
+            m2 += deviation
+
+
+def _rolling_blocked(
+    x: np.ndarray, N: int, mean: np.ndarray, m2: np.ndarray | None
+) -> None:
+    """
+    Rolling mean and sum of squared deviations along the last axis of x, written into `mean` and `m2` (if not None).
+
+    x is cut in chunks of N samples, and each chunk gets its own reference value (its first finite sample) and its own prefix sums of the deviations from it. A window starting at sample j of chunk k is the tail of chunk k plus the head of chunk k + 1; the head's sums are shifted to chunk k's reference, so every window sum is a few prefix-sum lookups, whatever N, and because the reference is local the sums of squares don't suffer from cancellation.
+    Chunks are anchored at the start of x and only depend on their own samples, so the result for a window only depends on the samples from the start of its chunk onwards. The chunks are processed in groups of about `_ROLLING_GROUP_SIZE` samples, which keeps the temporaries small.
+    """
+    n_out = mean.shape[-1]
+    if n_out == 0:
+        return
+    lead = x.shape[:-1]
+    n_blocks = -(-n_out // N)
+    group = max(_ROLLING_GROUP_SIZE // (N * max(int(np.prod(lead)), 1)), 1)
+    offsets = np.arange(1, N)
+
+    def _window_sums(csum: np.ndarray) -> np.ndarray:
+        # (..., chunks, N) prefix sums -> (..., chunks - 1, N) sums over each chunk's tail plus the next chunk's head
+        sums = np.empty(csum.shape[:-2] + (csum.shape[-2] - 1, N))
+        sums[..., 0] = csum[..., :-1, -1]
+        np.subtract(csum[..., :-1, -1:], csum[..., :-1, :-1], out=sums[..., 1:])
+        sums[..., 1:] += csum[..., 1:, :-1]
+        return sums
+
+    for first in range(0, n_blocks, group):
+        stop = min(first + group, n_blocks)
+        # chunks first..stop hold all samples of the windows starting in chunks first..stop-1
+        samples = x[..., first * N:(stop + 1) * N]
+        y = np.zeros(lead + ((stop + 1 - first) * N,))
+        y[..., :samples.shape[-1]] = samples
+        y = y.reshape(lead + (stop + 1 - first, N))
+        finite = np.isfinite(y)
+        all_finite = finite.all()
+        if all_finite:
+            ref = y[..., :1].copy()
+        else:
+            ref = np.take_along_axis(y, finite.argmax(axis=-1)[..., np.newaxis], axis=-1)
+            ref[~np.isfinite(ref)] = 0
+        y -= ref
+        if not all_finite:
+            y[~finite] = 0
+        # shift from the reference of a chunk to the one of the chunk before it
+        delta = ref[..., 1:, :] - ref[..., :-1, :]
+        csum = np.cumsum(y, axis=-1)
+        s1 = _window_sums(csum)
+        s1[..., 1:] += offsets * delta
+        block_mean = ref[..., :-1, :] + s1 / N
+        if not all_finite:
+            block_mean[_window_sums(np.cumsum(~finite, axis=-1)) > 0] = np.nan
+
+        start, end = first * N, min(stop * N, n_out)
+        mean[..., start:end] = block_mean.reshape(lead + (-1,))[..., :end - start]
+        if m2 is not None:
+            y *= y
+            s2 = _window_sums(np.cumsum(y, axis=-1, out=y))
+            # sum((d + delta)**2) over a head = sum(d**2) + 2 delta sum(d) + n delta**2
+            s2[..., 1:] += 2 * delta * csum[..., 1:, :-1] + offsets * delta * delta
+            s2 -= s1 * s1 / N
+            np.maximum(s2, 0, out=s2)
+            s2[np.isnan(block_mean)] = np.nan
+            m2[..., start:end] = s2.reshape(lead + (-1,))[..., :end - start]
+
+
+def _drop_nans(rol: np.ndarray) -> np.ndarray:
+    """Remove NaNs from a 1D rolling result (only copies if there are any). N-D results are returned as is, since removing values would make them ragged."""
+    if rol.ndim == 1 and np.isnan(rol).any():
+        rol = rol[~np.isnan(rol)]
+    return rol
 
 
 def running_average(
-    x: list[float] | npt.ArrayLike | tuple[float], N: int, remove_nans: bool = True
+    x: list[float] | npt.ArrayLike | tuple[float], N: int, remove_nans: bool = True, axis: int = -1
 ) -> npt.ArrayLike:
     """
     Calculates running average (or rolling mean) of data x, with meansize N.
-    Uses pandas Window algo's (see https://pandas.pydata.org/docs/reference/window.html).
-    More complex running statistics can be found there.
+    Gives the same result as pandas' rolling mean (see https://pandas.pydata.org/docs/reference/window.html), but runs in pure numpy and works along any axis of N-D data. More complex running statistics can be found in pandas.
     
     Parameters
     ----------
     x : list-like
-        Data
+        Data. If N-dimensional, every 1D series along `axis` is averaged independently.
     N : int
         Number of datapoints to average over
     remove_nans : bool, optional
         Whether to remove NaNs in running average, defaults to True
+    axis : int, optional
+        Axis to average along, defaults to -1.
 
     Returns
     -------
     np.array
-        Averaged data. Will miss the first N/2 datapoints if remove_nans is true, otherwise they will be NaNs.
+        Averaged data, float32 input stays float32. Will miss the first N-1 datapoints if remove_nans is true, otherwise they will be NaNs. For 1D data, windows containing NaNs are removed too.
     """
-    # return np.convolve(x, np.ones(N)/N, mode='valid')
-    a = pd.DataFrame({'data':x})
-    rolmean = a.rolling(N).mean()
-    rol = rolmean.to_numpy()[:,0]
+    rol, _ = _rolling_moments(x, N, axis=axis, pad=not remove_nans)
     if remove_nans:
-        rol = rol[~np.isnan(rol)]
+        rol = _drop_nans(rol)
     return rol
 
 
 def running_std(
-    x: list[float] | npt.ArrayLike | tuple[float], N: int, remove_nans: bool = True
+    x: list[float] | npt.ArrayLike | tuple[float], N: int, remove_nans: bool = True, axis: int = -1, ddof: int = 1
 ) -> npt.ArrayLike:
     """
     Calculates running standard deviation (or rolling std) of data x, over window N.
-    Uses pandas Window algo's (see https://pandas.pydata.org/docs/reference/window.html).
-    More complex running statistics can be found there.
+    Gives the same result as pandas' rolling std (see https://pandas.pydata.org/docs/reference/window.html), but runs in pure numpy and works along any axis of N-D data. More complex running statistics can be found in pandas.
 
     Parameters
     ----------
     x : list-like
-        Data
+        Data. If N-dimensional, every 1D series along `axis` is treated independently.
     N : int
         Number of datapoints to take std over
     remove_nans : bool, optional
         Whether to remove NaNs in running average, defaults to True
+    axis : int, optional
+        Axis to take the std along, defaults to -1.
+    ddof : int, optional
+        Delta degrees of freedom, defaults to 1 (like pandas).
 
     Returns
     -------
     np.array
-        Std'd data. Will miss the first N/2 datapoints if remove_nans is true, otherwise they will be NaNs.
+        Std'd data, float32 input stays float32. Will miss the first N-1 datapoints if remove_nans is true, otherwise they will be NaNs. For 1D data, windows containing NaNs are removed too.
     """
-    # return np.convolve(x, np.ones(N)/N, mode='valid')
-    a = pd.DataFrame({"data": x})
-    rolmean = a.rolling(N).std()
-    rol = rolmean.to_numpy()[:, 0]
+    _, var = _rolling_moments(x, N, axis=axis, ddof=ddof, pad=not remove_nans)
+    rol = np.sqrt(var, out=var)
     if remove_nans:
-        rol = rol[~np.isnan(rol)]
+        rol = _drop_nans(rol)
     return rol
 
 
+class RollingStats:
+    """
+    Streaming version of running_average and running_std, for data that comes in chunks.
+
+    Feed chunks one at a time with `update`; each call returns the rolling mean and std of all windows that are completed by that chunk. The last samples of the previous chunks are carried over to fill windows that straddle chunk boundaries, so memory stays bounded by the window size (at most 2N - 2 samples are kept). Concatenating the outputs gives exactly the same result as calling running_average/running_std on all data at once.
+
+    Parameters
+    ----------
+    N : int
+        Number of datapoints per window.
+    axis : int, optional
+        Axis along which the chunks are concatenated and the windows run, by default -1. Use axis=0 for batches of frames from `pjmstools.image.stream_video`.
+    ddof : int, optional
+        Delta degrees of freedom of the std, defaults to 1 (like running_std).
+    remove_nans : bool, optional
+        Whether to remove NaNs from 1D output, defaults to True (like running_average/running_std). The first N-1 datapoints are never emitted.
+
+    Examples
+    --------
+    >>> stats = RollingStats(50, axis=0)
+    >>> for batch in stream_video("movie.mp4"):
+    ...     mean, std = stats.update(batch)
+    """
+
+    def __init__(self, N: int, axis: int = -1, ddof: int = 1, remove_nans: bool = True) -> None:
+        if N < 1:
+            raise ValueError(f"Window size N must be at least 1, got {N}.")
+        self.N = N
+        self.axis = axis
+        self.ddof = ddof
+        self.remove_nans = remove_nans
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all data seen so far."""
+        self.n_seen = 0
+        self._tail = None
+        # Sample index of the first sample in the tail, and start of the next window to emit
+        self._tail_start = 0
+        self._next_window = 0
+
+    def update(
+        self, chunk: list[float] | npt.ArrayLike
+    ) -> tuple[npt.NDArray[np.floating], npt.NDArray[np.floating]]:
+        """
+        Add a chunk of data, and get the rolling mean and std of the windows it completes.
+
+        Parameters
+        ----------
+        chunk : list-like
+            Next piece of data. All dimensions except `axis` must match the previous chunks.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            Rolling mean and rolling std of the windows ending in this chunk (may be empty along `axis`).
+        """
+        chunk = np.moveaxis(np.asarray(chunk), self.axis, -1)
+        buffer = chunk if self._tail is None else np.concatenate([self._tail, chunk], axis=-1)
+        self.n_seen += chunk.shape[-1]
+
+        # The tail always starts on a block boundary of _rolling_blocked, so every window is
+        # computed from exactly the same samples as in the one-shot functions.
+        mean, var = _rolling_moments(buffer, self.N, axis=-1, ddof=self.ddof)
+        skip = self._next_window - self._tail_start
+        mean = mean[..., skip:]
+        std = np.sqrt(var[..., skip:])
+
+        self._next_window = max(self._next_window, self.n_seen - self.N + 1)
+        new_start = (self._next_window // self.N) * self.N
+        self._tail = buffer[..., new_start - self._tail_start:].copy()
+        self._tail_start = new_start
+
+        if self.remove_nans:
+            mean = _drop_nans(mean)
+            std = _drop_nans(std)
+        return np.moveaxis(mean, -1, self.axis), np.moveaxis(std, -1, self.axis)
+
+
 def is_iter(it: Any) -> bool:
     '''Check if input is an iterable'''
     try:
@@ -124,28 +482,83 @@ def is_iter(it: Any) -> bool:
         return False
 
 
-def auto_correlate(data:Iterable[float]) -> list[float]:
+def auto_correlate(
+    data: Iterable[float] | npt.ArrayLike, max_lag: int | None = None, axis: int = -1
+) -> npt.NDArray[np.float64]:
     """
-    Perform auto-correlation on given data. Returns list with  with index equal to lag time, e.g, the number at index 4 is correlation with lag_time 4.
+    Perform auto-correlation on given data. Returns array with index equal to lag time, e.g, the number at index 4 is correlation with lag_time 4.
 
-    Based on [pandas implementation](https://pandas.pydata.org/docs/reference/api/pandas.Series.autocorr.html),
-    check there for advanced custom usage.
+    Gives the same result as the [pandas implementation](https://pandas.pydata.org/docs/reference/api/pandas.Series.autocorr.html),
+    i.e. for every lag the Pearson correlation between the series and its shifted copy, but computed for all lags at once using FFTs (O(N log N) instead of O(N²)).
+    Like pandas, NaNs are skipped: every lag only uses the pairs where both values are present.
 
     Parameters
     ----------
-    data : Iterable[float]
-        Input data.
+    data : Iterable[float] | array_like
+        Input data. Can be N-dimensional, in which case every 1D series along `axis` is correlated independently.
+    max_lag : int | None, optional
+        Largest lag time to compute, by default None (all lags up to len - 2).
+    axis : int, optional
+        Axis along which the series run, by default -1.
 
     Returns
     -------
-    Iterable[float]
-        Auto-correlated data, with index equal to lag time.
-    """
-    d = pd.Series(data)
-    cor = list()
-    for lagtime in range(len(data)-1):
-        cor.append(d.autocorr(lag=lagtime))
-    return cor
+    np.ndarray
+        Auto-correlated data, with index equal to lag time along `axis`. Lags where the correlation is undefined (e.g. a constant window) are NaN.
+    """
+    if max_lag is not None and max_lag < 0:
+        raise ValueError(f"max_lag must be at least 0, got {max_lag}.")
+    x = np.moveaxis(np.asarray(data, dtype=np.float64), axis, -1)
+    n = x.shape[-1]
+    n_lags = max(n - 1, 0) if max_lag is None else min(max_lag + 1, max(n - 1, 0))
+    if n_lags == 0:
+        return np.moveaxis(np.empty(x.shape[:-1] + (0,)), -1, axis)
+    lags = np.arange(n_lags)
+    n_fft = 1 << int(2 * n - 1).bit_length()
+
+    def correlate(f: np.ndarray, g: np.ndarray | None = None) -> np.ndarray:
+        """sum(f[lag:] * g[:n-lag]) for all lags in one go"""
+        spectrum = np.fft.rfft(f, n=n_fft, axis=-1)
+        other = spectrum if g is None else np.fft.rfft(g, n=n_fft, axis=-1)
+        return np.fft.irfft(spectrum * np.conj(other), n=n_fft, axis=-1)[..., :n_lags]
+
+    valid = ~np.isnan(x)
+    if valid.all():
+        # Pearson correlation is shift invariant; centering keeps the sums below well conditioned
+        x = x - x.mean(axis=-1, keepdims=True)
+        cross = correlate(x)
+        # Sums of the leading (x[lag:]) and trailing (x[:n-lag]) windows via cumulative sums
+        zero = np.zeros(x.shape[:-1] + (1,))
+        csum = np.concatenate([zero, np.cumsum(x, axis=-1)], axis=-1)
+        csum2 = np.concatenate([zero, np.cumsum(x * x, axis=-1)], axis=-1)
+        overlap = n - lags
+        sum_a, sum_b = csum[..., -1:] - csum[..., lags], csum[..., n - lags]
+        sum_sq_a, sum_sq_b = csum2[..., -1:] - csum2[..., lags], csum2[..., n - lags]
+    else:
+        # Like pandas, only use the pairs where both values are present: with the NaNs set to 0, correlating
+        # with the validity mask gives the number of such pairs, and their sums and sums of squares, per lag.
+        mask = valid.astype(np.float64)
+        count = mask.sum(axis=-1, keepdims=True)
+        x = np.where(valid, x, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x = np.where(valid, x - np.where(count > 0, x.sum(axis=-1, keepdims=True) / count, 0.0), 0.0)
+        cross = correlate(x)
+        overlap = np.rint(correlate(mask))
+        sum_a, sum_b = correlate(x, mask), correlate(mask, x)
+        sum_sq_a, sum_sq_b = correlate(x * x, mask), correlate(mask, x * x)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_a, mean_b = sum_a / overlap, sum_b / overlap
+        sq_a, sq_b = sum_sq_a / overlap, sum_sq_b / overlap
+        cov = cross / overlap - mean_a * mean_b
+        var_a = sq_a - mean_a**2
+        var_b = sq_b - mean_b**2
+        # Windows that are constant up to rounding (or have fewer than 2 pairs) have no defined correlation (pandas gives NaN)
+        tol = 64 * np.finfo(np.float64).eps
+        undefined = (var_a <= tol * sq_a) | (var_b <= tol * sq_b) | ~(overlap > 1)
+        cor = cov / np.sqrt(var_a * var_b)
+    cor[np.broadcast_to(undefined, cor.shape)] = np.nan
+    return np.moveaxis(cor, -1, axis)
 
 
 if __name__ == "__main__":
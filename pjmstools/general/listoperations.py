@@ -4,7 +4,7 @@ from collections.abc import Iterable
 import numpy.typing as npt
 import numpy as np
 import collections
-from .general import is_iter
+from .general import is_iter, NearestIndex
 
 def flatten(nested_list : list[list[Any]]) -> list[Any]:
     """
@@ -47,12 +47,18 @@ def is_listoflists(l : list[list[Any]]|list[tuple[Any]]|tuple[tuple[Any],...]|tu
     else:
         return False
 
-def closest_in_list(l : list[float|int], item: float|int) -> int:
+def closest_in_list(
+    l : list[float|int], item: float|int|npt.ArrayLike, index: NearestIndex|None = None
+) -> int|npt.NDArray[np.intp]:
     """
     Returns the index of the closest item in a list to the given item.
     If there are multiple items equally close, returns the first one.
+    `item` can also be an array of items, in which case an array of indices is returned.
+    When searching the same list many times, pass a prebuilt `NearestIndex(l)` as `index`.
     """
-    return min(range(len(l)), key=lambda i: abs(l[i] - item))
+    if index is None:
+        index = NearestIndex(l)
+    return index.query(item)
 
 def _merge_identical_listoflist(l : list[Any], upwards:bool=False) -> list[Any]:
     """Helper for nested_to_listoflist, probably not usefull alone"""
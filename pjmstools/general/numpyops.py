@@ -2,16 +2,24 @@
 Functions acting on, or replacing parts of numpy.
 """
 import builtins
+import os
+from itertools import repeat
+from warnings import catch_warnings, simplefilter
 import numpy as np
-import scipy
-import scipy.stats
 from operator import index
 from collections import namedtuple
 import numpy.typing as npt
 
+
+BinnedStatisticddResult = namedtuple('BinnedStatisticddResult',
+                                     ('statistic', 'bin_edges',
+                                      'binnumber'))
+
+
 def binned_statistic_dd(sample, values, statistic='mean',
                         bins=10, range=None, expand_binnumbers=False,
-                        binned_statistic_result=None):
+                        binned_statistic_result=None, workers=1,
+                        pool='thread', q=None, method='linear'):
     """
     Compute a multidimensional binned statistic for a set of data.
 
@@ -38,6 +46,10 @@ def binned_statistic_dd(sample, values, statistic='mean',
             Empty bins will be represented by NaN.
           * 'median' : compute the median of values for points within each
             bin. Empty bins will be represented by NaN.
+          * 'quantile' : compute the quantile(s) `q` of values for points
+            within each bin, using interpolation `method`. All quantiles come
+            from a single sort. Like `np.quantile`, bins containing NaNs
+            give NaN. Empty bins will be represented by NaN.
           * 'count' : compute the count of points within each bin.  This is
             identical to an unweighted histogram.  `values` array is not
             referenced.
@@ -51,9 +63,20 @@ def binned_statistic_dd(sample, values, statistic='mean',
             Empty bins will be represented by NaN.
           * 'max' : compute the maximum of values for point within each bin.
             Empty bins will be represented by NaN.
+          * 'nanmean' : compute the mean of values for points within each
+            bin, ignoring NaNs. Empty bins (or bins with only NaNs) will be
+            represented by NaN.
+          * 'nansum' : compute the sum of values within each bin, ignoring
+            NaNs. Empty bins will be represented by 0.
+          * 'nanstd' : compute the standard deviation (ddof=0) within each
+            bin, ignoring NaNs. Empty bins (or bins with only NaNs) will be
+            represented by NaN.
+          * 'nancount' : compute the number of non-NaN values within each
+            bin.
           * function : a user-defined function which takes a 1D array of
             values, and outputs a single numerical statistic. This function
-            will be called on the values in each bin.  Empty bins will be
+            will be called on the values in each bin (as a contiguous view,
+            in their original order).  Empty bins will be
             represented by function([]), or NaN if this returns an error.
 
     bins : sequence or positive int, optional
@@ -81,11 +104,33 @@ def binned_statistic_dd(sample, values, statistic='mean',
         (the default)
 
         .. versionadded:: 0.17.0
+    workers : int, optional
+        Only used if `statistic` is a callable. Number of workers over which
+        the bins are divided; -1 means one per CPU. Default is 1 (serial).
+        Worth it for expensive callables and many bins; the result is
+        identical to the serial one.
+    pool : {'thread', 'process'}, optional
+        Kind of pool used if `workers` is not 1. Threads (default) have no
+        overhead, but only help if the callable releases the GIL (most numpy
+        functions do). Processes always run in parallel, but the callable
+        must be picklable (e.g. not a lambda) and the values of each bin are
+        copied to the workers.
+    q : float or sequence of floats, optional
+        Quantile(s) to compute for ``statistic='quantile'``, between 0 and 1.
+        For a sequence, the output gets an extra first axis along which the
+        quantiles run (like `np.quantile`).
+    method : str, optional
+        Interpolation method for ``statistic='quantile'``, one of 'linear'
+        (default), 'lower', 'higher', 'nearest', 'midpoint', 'weibull',
+        'hazen', 'median_unbiased', 'normal_unbiased' or
+        'interpolated_inverted_cdf'. See `np.quantile`.
 
     Returns
     -------
     statistic : ndarray, shape(nx1, nx2, nx3,...)
         The values of the selected statistic in each two-dimensional bin.
+        For ``statistic='quantile'`` with a sequence `q`, the first axis
+        runs over the quantiles.
     bin_edges : list of ndarrays
         A list of D arrays describing the (nxi + 1) bin edges for each
         dimension.
@@ -169,10 +214,321 @@ def binned_statistic_dd(sample, values, statistic='mean',
     ...                                  binned_statistic_result=ret,
     ...                                  statistic='mean')
     """
-    known_stats = ['mean', 'nanmean', 'median', 'count', 'sum', 'std', 'min', 'max']
-    if not callable(statistic) and statistic not in known_stats:
+    _check_statistic(statistic, q, method)
+
+    Dlen, Ndim, nbin, edges, binnumbers = _binning(
+        sample, bins, range, binned_statistic_result
+    )
+    values, input_shape = _prepare_values(values, Dlen, statistic)
+
+    cache = _BinCache(binnumbers, nbin.prod())
+    result = _calc_flat_statistic(statistic, values, cache, workers, pool,
+                                  q, method)
+    result = _unflatten_result(result, nbin, input_shape)
+
+    # Unravel binnumbers into an ndarray, each row the bins for each dimension
+    if expand_binnumbers and Ndim > 1:
+        binnumbers = np.asarray(np.unravel_index(binnumbers, nbin))
+
+    return BinnedStatisticddResult(result, edges, binnumbers)
+
+
+class BinningPlan:
+    """
+    Binning of a sample, to compute many statistics over many values at once.
+
+    `binned_statistic_dd` redoes the binning and all intermediate results for every statistic. A plan bins the sample once and caches the bin edges, bin numbers and bin counts. Per-bin sums and the within-bin sort order of a values array are shared between all statistics computed in one `compute` call, so e.g. mean + std cost one bincount of sums, and median + other order statistics cost one sort.
+
+    A plan has `bin_edges` and `binnumber` attributes, so it can also be passed as `binned_statistic_result` to `binned_statistic_dd`.
+
+    Parameters
+    ----------
+    sample : array_like
+        Data to histogram passed as a sequence of N arrays of length D, or
+        as an (N,D) array.
+    bins : sequence or positive int, optional
+        Bin specification, see `binned_statistic_dd`.
+    range : sequence, optional
+        A sequence of lower and upper bin edges, see `binned_statistic_dd`.
+    binned_statistic_result : binnedStatisticddResult, optional
+        Reuse the bin edges and bin numbers of a previous call to
+        `binned_statistic_dd` instead of binning `sample`.
+
+    Examples
+    --------
+    >>> plan = BinningPlan(positions, bins=50)
+    >>> stats = plan.compute([speed, size], ['mean', 'std', 'median', 'count'])
+    >>> stats['mean'].shape
+    (2, 50, 50)
+    """
+
+    def __init__(self, sample, bins=10, range=None, binned_statistic_result=None):
+        self.n_samples, self.ndim, self.nbin, self.bin_edges, self.binnumber = _binning(
+            sample, bins, range, binned_statistic_result
+        )
+        self._cache = _BinCache(self.binnumber, self.nbin.prod())
+
+    @property
+    def count(self) -> npt.NDArray[np.intp]:
+        """Number of samples in each bin, shape (nx1, nx2, ...)."""
+        return self._cache.count.reshape(self.nbin)[self.ndim * (slice(1, -1),)]
+
+    def compute(self, values, statistics=('mean',), workers=1, pool='thread',
+                q=None, method='linear') -> dict:
+        """
+        Compute several statistics of the values in each bin.
+
+        Parameters
+        ----------
+        values : (N,) array_like or list of (N,) array_like
+            The data on which the statistics will be computed, see
+            `binned_statistic_dd`.
+        statistics : sequence of strings or callables, optional
+            Statistics to compute, any that `binned_statistic_dd` accepts.
+            Defaults to only 'mean'.
+        workers, pool : optional
+            Parallel execution of callable statistics, see
+            `binned_statistic_dd`.
+        q, method : optional
+            Quantile(s) and interpolation method for 'quantile', see
+            `binned_statistic_dd`.
+
+        Returns
+        -------
+        dict
+            Maps each statistic in `statistics` to its result, shaped as the
+            `statistic` returned by `binned_statistic_dd`.
+        """
+        if isinstance(statistics, str) or callable(statistics):
+            statistics = [statistics]
+        for statistic in statistics:
+            _check_statistic(statistic, q, method)
+        values, input_shape = _prepare_values(values, self.n_samples, None)
+        # Sums and sort orders belong to the values, so only share them within this call.
+        self._cache.clear_values()
+        results = {}
+        for statistic in statistics:
+            result = _calc_flat_statistic(statistic, values, self._cache,
+                                          workers, pool, q, method)
+            results[statistic] = _unflatten_result(result, self.nbin, input_shape)
+        self._cache.clear_values()
+        return results
+
+
+class BinnedStatisticAccumulator:
+    """
+    Out-of-core `binned_statistic_dd`: accumulates per-bin statistics over chunks of data.
+
+    For data that does not fit in memory. The bin edges are fixed up front; every chunk of `(sample, values)` is binned on its own and reduced to mergeable per-bin partial results (count, sum, sum of squared deviations, min and max). Memory use only depends on the number of bins. Accumulators over the same bins can be merged, so chunks can be processed in separate processes (accumulators pickle fine) and combined at the end.
+
+    The supported statistics are 'count', 'sum', 'mean', 'std', 'min' and 'max', with the same conventions (empty bins, ddof=0 std, NaN handling) as `binned_statistic_dd`. Instead of a plain sum of squares, the squared deviations from the bin mean are kept and merged with the parallel algorithm of Chan et al., so the std stays accurate for data with a large offset.
+
+    Parameters
+    ----------
+    bins : sequence or positive int
+        Bin edges for each dimension, or the number of bins (then `range` is required, since edges cannot be derived from data that has not been seen yet).
+    range : sequence, optional
+        A sequence of lower and upper bin edges per dimension, used if `bins` gives numbers of bins.
+
+    Examples
+    --------
+    >>> acc = BinnedStatisticAccumulator(bins=50, range=[(0, 1), (0, 1)])
+    >>> acc.consume((chunk.positions, chunk.speed) for chunk in load_chunks())
+    >>> mean = acc.result('mean')
+    """
+
+    statistics = ('count', 'sum', 'mean', 'std', 'min', 'max')
+
+    def __init__(self, bins, range=None):
+        try:
+            bins = index(bins)
+        except TypeError:
+            pass
+        if isinstance(bins, int):
+            if range is None:
+                raise ValueError('Give bin edges, or a range to go with the number of bins.')
+            bins = len(range) * [bins]
+        Ndim = len(bins)
+        if range is None:
+            if any(np.isscalar(b) for b in bins):
+                raise ValueError('Give bin edges, or a range to go with the number of bins.')
+            # Only used for scalar bins, of which there are none here.
+            range = Ndim * [(0, 1)]
+        self.nbin, self.bin_edges, self._dedges = _bin_edges(np.empty((0, Ndim)), bins, range)
+        self.ndim = Ndim
+        self.n_samples = 0
+        self._values_shape = None
+        self._count = np.zeros(self.nbin.prod(), dtype=np.int64)
+        self._sum = self._m2 = self._min = self._max = None
+
+    def update(self, sample, values):
+        """
+        Add a chunk of data.
+
+        Parameters
+        ----------
+        sample : array_like
+            Chunk of the sample, as a sequence of N arrays of length D, or
+            as an (N,D) array.
+        values : (N,) array_like or list of (N,) array_like
+            The values belonging to the chunk. The leading dimensions must be
+            the same for every chunk.
+
+        Returns
+        -------
+        BinnedStatisticAccumulator
+            self, for chaining.
+        """
+        sample = _as_2d_sample(sample)
+        binnumbers = _bin_numbers(sample, self.nbin, self.bin_edges, self._dedges)
+        values, input_shape = _prepare_values(values, sample.shape[0], None)
+        if np.iscomplexobj(values):
+            raise TypeError('BinnedStatisticAccumulator only supports real values.')
+        self._check_values_shape(input_shape[:-1])
+
+        n_flat = self.nbin.prod()
+        cache = _BinCache(binnumbers, n_flat)
+        count = cache.count
+        flatsum = _calc_flat_statistic('sum', values, cache)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            flatmean = flatsum / count
+        m2 = np.empty_like(flatsum)
+        for vv in builtins.range(values.shape[0]):
+            delta = values[vv] - flatmean[vv, binnumbers]
+            m2[vv] = _bincount(binnumbers, delta * delta, minlength=n_flat)
+        flatmin = _calc_flat_statistic('min', values, cache)
+        flatmax = _calc_flat_statistic('max', values, cache)
+        flatmax[:, count == 0] = -np.inf
+
+        self._merge_state(sample.shape[0], count, flatsum, m2, flatmin, flatmax)
+        return self
+
+    def consume(self, chunks):
+        """
+        Add all `(sample, values)` chunks from an iterable, e.g. a generator reading them from disk.
+
+        Returns
+        -------
+        BinnedStatisticAccumulator
+            self, for chaining.
+        """
+        for sample, values in chunks:
+            self.update(sample, values)
+        return self
+
+    def merge(self, other):
+        """
+        Add the data of another accumulator with the same bins (e.g. from another process).
+
+        Returns
+        -------
+        BinnedStatisticAccumulator
+            self, for chaining.
+        """
+        if not (np.array_equal(self.nbin, other.nbin) and all(
+                np.array_equal(a, b) for a, b in zip(self.bin_edges, other.bin_edges))):
+            raise ValueError('Can only merge accumulators with identical bin edges.')
+        if other._sum is None:
+            return self
+        self._check_values_shape(other._values_shape)
+        self._merge_state(other.n_samples, other._count, other._sum,
+                          other._m2, other._min, other._max)
+        return self
+
+    def result(self, statistic='mean'):
+        """
+        Final value of a statistic in each bin.
+
+        Parameters
+        ----------
+        statistic : str, optional
+            One of 'count', 'sum', 'mean', 'std', 'min', 'max'. Default is 'mean'.
+
+        Returns
+        -------
+        ndarray
+            Shaped like the `statistic` returned by `binned_statistic_dd`.
+        """
+        if statistic not in self.statistics:
+            raise ValueError(f'invalid statistic {statistic!r}, choose from {self.statistics}')
+        if self._sum is None:
+            raise ValueError('No data has been added yet.')
+        count = self._count
+        empty = count == 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # results never share memory with the running state, so editing them cannot change the accumulator
+            if statistic == 'count':
+                result = np.broadcast_to(count.astype(np.float64), self._sum.shape).copy()
+            elif statistic == 'sum':
+                result = self._sum.copy()
+            elif statistic == 'mean':
+                result = self._sum / count
+            elif statistic == 'std':
+                result = np.sqrt(self._m2 / count)
+            elif statistic == 'min':
+                result = self._min.copy()
+            else:
+                result = self._max.copy()
+                result[:, empty] = np.nan
+        return _unflatten_result(result, self.nbin, list(self._values_shape) + [0])
+
+    def _check_values_shape(self, values_shape):
+        values_shape = list(values_shape)
+        if self._values_shape is None:
+            self._values_shape = values_shape
+        elif self._values_shape != values_shape:
+            raise ValueError(f'values have leading shape {values_shape}, expected {self._values_shape}.')
+
+    def _merge_state(self, n_samples, count, flatsum, m2, flatmin, flatmax):
+        self.n_samples += n_samples
+        if self._sum is None:
+            self._count = self._count + count
+            self._sum, self._m2 = flatsum.copy(), m2.copy()
+            self._min, self._max = flatmin.copy(), flatmax.copy()
+            return
+        total = self._count + count
+        both = (self._count > 0) & (count > 0)
+        # Chan et al.: M2 = M2_a + M2_b + delta^2 * n_a * n_b / n
+        delta = flatsum[:, both] / count[both] - self._sum[:, both] / self._count[both]
+        self._m2 += m2
+        self._m2[:, both] += delta**2 * (self._count[both] * count[both] / total[both])
+        self._sum += flatsum
+        self._count = total
+        np.fmin(self._min, flatmin, out=self._min)
+        np.maximum(self._max, flatmax, out=self._max)
+
+
+_KNOWN_STATS = ['mean', 'median', 'count', 'sum', 'std', 'min', 'max',
+                'nanmean', 'nansum', 'nanstd', 'nancount', 'quantile']
+
+# (alpha, beta) of the continuous quantile methods, as in `np.quantile`
+# (Hyndman & Fan, 1996).
+_QUANTILE_ALPHA_BETA = {
+    'interpolated_inverted_cdf': (0, 1),
+    'hazen': (0.5, 0.5),
+    'weibull': (0, 0),
+    'linear': (1, 1),
+    'median_unbiased': (1/3, 1/3),
+    'normal_unbiased': (3/8, 3/8),
+}
+_QUANTILE_METHODS = list(_QUANTILE_ALPHA_BETA) + ['lower', 'higher', 'nearest',
+                                                  'midpoint']
+
+
+def _check_statistic(statistic, q=None, method='linear'):
+    if not callable(statistic) and statistic not in _KNOWN_STATS:
         raise ValueError(f'invalid statistic {statistic!r}')
+    if statistic == 'quantile':
+        if q is None:
+            raise ValueError("statistic 'quantile' needs quantile(s) `q`")
+        if np.any((np.asarray(q) < 0) | (np.asarray(q) > 1)):
+            raise ValueError('Quantiles must be in the range [0, 1]')
+        if method not in _QUANTILE_METHODS:
+            raise ValueError(f'invalid quantile method {method!r}')
+
 
+def _binning(sample, bins, range, binned_statistic_result):
+    """Bin the sample: returns Dlen, Ndim, nbin, edges and binnumbers"""
     try:
         bins = index(bins)
     except TypeError:
@@ -184,8 +540,33 @@ def binned_statistic_dd(sample, values, statistic='mean',
     if isinstance(bins, int) and not np.isfinite(sample).all():
         raise ValueError(f'{sample!r} contains non-finite values.')
 
+    sample = _as_2d_sample(sample)
     # `Ndim` is the number of dimensions (e.g. `2` for `binned_statistic_2d`)
     # `Dlen` is the length of elements along each dimension.
+    Dlen, Ndim = sample.shape
+
+    try:
+        M = len(bins)
+        if M != Ndim:
+            raise AttributeError('The dimension of bins must be equal '
+                                 'to the dimension of the sample x.')
+    except TypeError:
+        bins = Ndim * [bins]
+
+    if binned_statistic_result is None:
+        nbin, edges, dedges = _bin_edges(sample, bins, range)
+        binnumbers = _bin_numbers(sample, nbin, edges, dedges)
+    else:
+        edges = binned_statistic_result.bin_edges
+        nbin = np.array([len(edges[i]) + 1 for i in builtins.range(Ndim)])
+        # +1 for outlier bins
+        binnumbers = binned_statistic_result.binnumber
+
+    return Dlen, Ndim, nbin, edges, binnumbers
+
+
+def _as_2d_sample(sample):
+    """Sample as an (N,D) array"""
     # This code is based on np.histogramdd
     try:
         # `sample` is an ND-array.
@@ -193,8 +574,11 @@ def binned_statistic_dd(sample, values, statistic='mean',
     except (AttributeError, ValueError):
         # `sample` is a sequence of 1D arrays.
         sample = np.atleast_2d(sample).T
-        Dlen, Ndim = sample.shape
+    return sample
 
+
+def _prepare_values(values, Dlen, statistic):
+    """Make `values` 2D to iterate over rows; also returns its original shape"""
     # Store initial shape of `values` to preserve it in the output
     values = np.asarray(values)
     input_shape = list(values.shape)
@@ -206,86 +590,180 @@ def binned_statistic_dd(sample, values, statistic='mean',
     if statistic != 'count' and Vlen != Dlen:
         raise AttributeError('The number of `values` elements must match the '
                              'length of each `sample` dimension.')
+    return values, input_shape
 
-    try:
-        M = len(bins)
-        if M != Ndim:
-            raise AttributeError('The dimension of bins must be equal '
-                                 'to the dimension of the sample x.')
-    except TypeError:
-        bins = Ndim * [bins]
 
-    if binned_statistic_result is None:
-        nbin, edges, dedges = np._bin_edges(sample, bins, range)
-        binnumbers = np._bin_numbers(sample, nbin, edges, dedges)
-    else:
-        edges = binned_statistic_result.bin_edges
-        nbin = np.array([len(edges[i]) + 1 for i in builtins.range(Ndim)])
-        # +1 for outlier bins
-        dedges = [np.diff(edges[i]) for i in builtins.range(Ndim)]
-        binnumbers = binned_statistic_result.binnumber
+def _unflatten_result(result, nbin, input_shape):
+    """
+    Go from the flat (..., Vdim, nbin.prod()) result to the output shape.
+    Leading axes (e.g. quantiles) are kept in front.
+    """
+    lead = list(result.shape[:-1])
+    Ndim = len(nbin)
+    # Shape into a proper matrix
+    result = result.reshape(lead + list(nbin))
+
+    # Remove outliers (indices 0 and -1 for each bin-dimension).
+    core = tuple(len(lead) * [slice(None)] + Ndim * [slice(1, -1)])
+    result = result[core]
+
+    if np.any(result.shape[len(lead):] != nbin - 2):
+        raise RuntimeError('Internal Shape Error')
+
+    # Reshape to have output (`result`) match input (`values`) shape
+    return result.reshape(lead[:-1] + input_shape[:-1] + list(nbin-2))
 
+
+class _BinCache:
+    """
+    Intermediate results of a binning that can be shared between statistics.
+
+    Counts only depend on the bin numbers. Sums and sort orders also depend
+    on the values, and are keyed by row of the values array; call
+    `clear_values` when the values change.
+    """
+
+    def __init__(self, binnumbers, n_flat):
+        self.binnumbers = binnumbers
+        self.n_flat = n_flat
+        self._count = None
+        self._grouped = None
+        self._sums = {}
+        self._sorted = {}
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = np.bincount(self.binnumbers, minlength=self.n_flat)
+        return self._count
+
+    def clear_values(self):
+        self._sums.clear()
+        self._sorted.clear()
+
+    def sum(self, values, vv):
+        if vv not in self._sums:
+            self._sums[vv] = _bincount(self.binnumbers, values[vv],
+                                       minlength=self.n_flat)
+        return self._sums[vv]
+
+    @property
+    def grouped(self):
+        """
+        Order that sorts the samples by bin number (stable, so within a bin
+        the original order is kept), with the bin number, start (in sorted
+        order) and size of each non-empty bin.
+        """
+        if self._grouped is None:
+            order = np.argsort(self.binnumbers, kind='stable')
+            filled = self.count.nonzero()[0]
+            counts = self.count[filled]
+            starts = np.cumsum(counts) - counts
+            self._grouped = (order, filled, starts, counts)
+        return self._grouped
+
+    def sorted(self, values, vv):
+        """
+        Order `i` that sorts values[vv] by bin number, and within each bin by
+        value. Also returns the bin number, start (in sorted order) and
+        size of each non-empty bin.
+        """
+        if vv not in self._sorted:
+            i = np.lexsort((values[vv], self.binnumbers))
+            filled = self.count.nonzero()[0]
+            counts = self.count[filled]
+            starts = np.cumsum(counts) - counts
+            self._sorted[vv] = (i, filled, starts, counts)
+        return self._sorted[vv]
+
+
+def _calc_flat_statistic(statistic, values, cache, workers=1, pool='thread',
+                         q=None, method='linear'):
+    """
+    Compute `statistic` per bin; returns a (Vdim, nbin.prod()) array, or
+    (len(q), Vdim, nbin.prod()) for a sequence of quantiles.
+    """
+    binnumbers = cache.binnumbers
+    Vdim = values.shape[0]
     # Avoid overflow with double precision. Complex `values` -> `complex128`.
     result_type = np.result_type(values, np.float64)
-    result = np.empty([Vdim, nbin.prod()], dtype=result_type)
+    result = np.empty([Vdim, cache.n_flat], dtype=result_type)
 
     if statistic in {'mean', np.mean}:
         result.fill(np.nan)
-        flatcount = np._bincount(binnumbers, None)
+        flatcount = cache.count
         a = flatcount.nonzero()
         for vv in builtins.range(Vdim):
-            flatsum = np._bincount(binnumbers, values[vv])
+            flatsum = cache.sum(values, vv)
             result[vv, a] = flatsum[a] / flatcount[a]
     elif statistic in {'std', np.std}:
         result.fill(np.nan)
-        flatcount = np._bincount(binnumbers, None)
+        flatcount = cache.count
         a = flatcount.nonzero()
         for vv in builtins.range(Vdim):
-            flatsum = np._bincount(binnumbers, values[vv])
+            flatsum = cache.sum(values, vv)
             delta = values[vv] - flatsum[binnumbers] / flatcount[binnumbers]
             std = np.sqrt(
-                np_bincount(binnumbers, delta*np.conj(delta))[a] / flatcount[a]
+                _bincount(binnumbers, delta*np.conj(delta))[a] / flatcount[a]
             )
             result[vv, a] = std
         result = np.real(result)
     elif statistic == 'count':
-        result = np.empty([Vdim, nbin.prod()], dtype=np.float64)
-        result.fill(0)
-        flatcount = np._bincount(binnumbers, None)
-        a = np.arange(len(flatcount))
-        result[:, a] = flatcount[np.newaxis, :]
+        result = np.empty([Vdim, cache.n_flat], dtype=np.float64)
+        result[:] = cache.count[np.newaxis, :]
     elif statistic in {'sum', np.sum}:
-        result.fill(0)
         for vv in builtins.range(Vdim):
-            flatsum = np._bincount(binnumbers, values[vv])
-            a = np.arange(len(flatsum))
-            result[vv, a] = flatsum
+            result[vv] = cache.sum(values, vv)
     elif statistic in {'median', np.median}:
-        result.fill(np.nan)
-        for vv in builtins.range(Vdim):
-            i = np.lexsort((values[vv], binnumbers))
-            _, j, counts = np.unique(binnumbers[i],
-                                     return_index=True, return_counts=True)
-            mid = j + (counts - 1) / 2
-            mid_a = values[vv, i][np.floor(mid).astype(int)]
-            mid_b = values[vv, i][np.ceil(mid).astype(int)]
-            medians = (mid_a + mid_b) / 2
-            result[vv, binnumbers[i][j]] = medians
+        # The median is the 'midpoint' 0.5 quantile
+        result = _calc_flat_quantiles(values, cache, [0.5], 'midpoint',
+                                      result_type, nan_to_nan=False)[0]
+    elif statistic == 'quantile':
+        result = _calc_flat_quantiles(values, cache, np.atleast_1d(q), method,
+                                      result_type)
+        if np.ndim(q) == 0:
+            result = result[0]
     elif statistic in {'min', np.min}:
+        # Grouped reduction in O(N). fmin skips NaNs, like the sorted
+        # assignment this replaces did for the minimum.
         result.fill(np.nan)
         for vv in builtins.range(Vdim):
-            i = np.argsort(values[vv])[::-1]  # Reversed so the min is last
-            result[vv, binnumbers[i]] = values[vv, i]
+            np.fmin.at(result[vv], binnumbers, values[vv])
     elif statistic in {'max', np.max}:
-        result.fill(np.nan)
-        for vv in builtins.range(Vdim):
-            i = np.argsort(values[vv])
-            result[vv, binnumbers[i]] = values[vv, i]
-    elif statistic in {np.nanmean, "nanmean"}:
-        result.fill(np.nan)
-        for i in np.unique(binnumbers):
+        # maximum propagates NaNs, like the sorted assignment this replaces.
+        flatcount = cache.count
+        result.fill(-np.inf)
+        with np.errstate(invalid='ignore'):
             for vv in builtins.range(Vdim):
-                result[vv, i] = np.nanmean(values[vv, binnumbers == i])
+                np.maximum.at(result[vv], binnumbers, values[vv])
+        result[:, flatcount == 0] = np.nan
+    elif statistic in {'nanmean', np.nanmean, 'nansum', np.nansum,
+                       'nanstd', np.nanstd, 'nancount'}:
+        # bincount over the non-NaN values only, so O(N) instead of a mask
+        # over all samples for every bin.
+        for vv in builtins.range(Vdim):
+            good = ~np.isnan(values[vv])
+            flatcount = _bincount(binnumbers, good, minlength=result.shape[1])
+            if statistic == 'nancount':
+                result[vv] = flatcount
+                continue
+            clean = np.where(good, values[vv], 0)
+            flatsum = _bincount(binnumbers, clean, minlength=result.shape[1])
+            if statistic in {'nansum', np.nansum}:
+                result[vv] = flatsum
+                continue
+            with np.errstate(invalid='ignore', divide='ignore'):
+                flatmean = flatsum / flatcount
+            if statistic in {'nanmean', np.nanmean}:
+                result[vv] = flatmean
+                continue
+            delta = np.where(good, values[vv] - flatmean[binnumbers], 0)
+            flatvar = _bincount(binnumbers, delta*np.conj(delta),
+                                minlength=result.shape[1])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[vv] = np.sqrt(flatvar / flatcount)
+        if statistic in {'nanstd', np.nanstd, 'nancount'}:
+            result = np.real(result)
     elif callable(statistic):
         with np.errstate(invalid='ignore'), catch_warnings():
             simplefilter("ignore", RuntimeWarning)
@@ -297,30 +775,201 @@ def binned_statistic_dd(sample, values, statistic='mean',
             result = result.astype(np.complex128)
         result.fill(null)
         try:
-            np._calc_binned_statistic(
-                Vdim, binnumbers, result, values, statistic
+            _calc_grouped_statistic(
+                values, cache, result, statistic, workers, pool
             )
         except ValueError:
             result = result.astype(np.complex128)
-            np._calc_binned_statistic(
-                Vdim, binnumbers, result, values, statistic
+            _calc_grouped_statistic(
+                values, cache, result, statistic, workers, pool
             )
 
-    # Shape into a proper matrix
-    result = result.reshape(np.append(Vdim, nbin))
+    return result
 
-    # Remove outliers (indices 0 and -1 for each bin-dimension).
-    core = tuple([slice(None)] + Ndim * [slice(1, -1)])
-    result = result[core]
 
-    # Unravel binnumbers into an ndarray, each row the bins for each dimension
-    if expand_binnumbers and Ndim > 1:
-        binnumbers = np.asarray(np.unravel_index(binnumbers, nbin))
+def _bincount(x, weights, minlength=0):
+    if np.iscomplexobj(weights):
+        a = np.bincount(x, np.real(weights), minlength=minlength)
+        b = np.bincount(x, np.imag(weights), minlength=minlength)
+        z = a + b*1j
 
-    if np.any(result.shape[1:] != nbin - 2):
-        raise RuntimeError('Internal Shape Error')
+    else:
+        z = np.bincount(x, weights, minlength=minlength)
+    return z
 
-    # Reshape to have output (`result`) match input (`values`) shape
-    result = result.reshape(input_shape[:-1] + list(nbin-2))
 
-    return np.BinnedStatisticddResult(result, edges, binnumbers)
+def _calc_flat_quantiles(values, cache, q, method, result_type,
+                         nan_to_nan=True):
+    """
+    Quantiles `q` (1D) of the values in every bin, from one sort per row of
+    values. Returns a (len(q), Vdim, nbin.prod()) array. If `nan_to_nan`,
+    bins containing a NaN give NaN (like np.quantile); otherwise NaNs are
+    treated as the largest values.
+    """
+    q = np.asarray(q, dtype=np.float64)[:, np.newaxis]
+    result = np.full([len(q), values.shape[0], cache.n_flat], np.nan,
+                     dtype=result_type)
+    for vv in builtins.range(values.shape[0]):
+        i, filled, starts, counts = cache.sorted(values, vv)
+        sorted_values = values[vv, i]
+        n = counts[np.newaxis, :]
+        if method in _QUANTILE_ALPHA_BETA:
+            alpha, beta = _QUANTILE_ALPHA_BETA[method]
+            # Virtual (fractional) index into each sorted bin, as np.quantile
+            virtual = n * q + (alpha + q * (1 - alpha - beta)) - 1
+            below = np.floor(virtual)
+            gamma = virtual - below
+            lower = np.clip(below, 0, n - 1).astype(np.intp)
+            upper = np.clip(below + 1, 0, n - 1).astype(np.intp)
+            a = sorted_values[starts + lower]
+            b = sorted_values[starts + upper]
+            # Same lerp as np.quantile, exact at both ends
+            diff = b - a
+            quantiles = np.where(gamma >= 0.5, b - diff * (1 - gamma),
+                                 a + diff * gamma)
+        elif method == 'midpoint':
+            position = q * (n - 1)
+            a = sorted_values[starts + np.floor(position).astype(np.intp)]
+            b = sorted_values[starts + np.ceil(position).astype(np.intp)]
+            quantiles = (a + b) / 2
+        else:
+            position = q * (n - 1)
+            position = {'lower': np.floor, 'higher': np.ceil,
+                        'nearest': np.around}[method](position)
+            quantiles = sorted_values[starts + position.astype(np.intp)]
+        result[:, vv, filled] = quantiles
+        if nan_to_nan:
+            has_nan = np.bincount(cache.binnumbers, np.isnan(values[vv]),
+                                  minlength=cache.n_flat) > 0
+            result[:, vv, has_nan] = np.nan
+    return result
+
+
+def _calc_grouped_statistic(values, cache, result, stat_func, workers=1,
+                            pool='thread'):
+    """
+    Apply `stat_func` to the values of every non-empty bin. Sorts the values
+    by bin once, then hands each bin a contiguous slice.
+    """
+    order, filled, starts, counts = cache.grouped
+    if len(filled) == 0:
+        return
+    for vv in builtins.range(values.shape[0]):
+        groups = np.split(values[vv, order], (starts + counts)[:-1])
+        stats = np.asarray(_map_statistic(stat_func, groups, workers, pool))
+        if np.iscomplexobj(stats) and not np.iscomplexobj(result):
+            raise ValueError("The statistic function returns complex ")
+        result[vv, filled] = stats
+
+
+def _map_statistic(stat_func, groups, workers=1, pool='thread'):
+    """[stat_func(g) for g in groups], optionally spread over a pool"""
+    if workers == -1:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f'workers must be -1 or at least 1, got {workers}')
+    if workers == 1 or len(groups) < 2:
+        return _apply_to_groups(stat_func, groups)
+    # imported here: concurrent.futures.process pulls in multiprocessing, which would slow down `import pjmstools`
+    if pool == 'thread':
+        from concurrent.futures import ThreadPoolExecutor as executor
+    elif pool == 'process':
+        from concurrent.futures import ProcessPoolExecutor as executor
+    else:
+        raise ValueError(f"pool must be 'thread' or 'process', got {pool!r}")
+    # A few batches per worker balances the load without much overhead.
+    n_batches = min(len(groups), 4 * workers)
+    bounds = np.linspace(0, len(groups), n_batches + 1).astype(int)
+    batches = [groups[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+    with executor(max_workers=workers) as ex:
+        parts = ex.map(_apply_to_groups, repeat(stat_func), batches)
+        return [stat for part in parts for stat in part]
+
+
+def _apply_to_groups(stat_func, groups):
+    return [stat_func(group) for group in groups]
+
+
+def _bin_edges(sample, bins=None, range=None):
+    """ Create edge arrays
+    """
+    Dlen, Ndim = sample.shape
+
+    nbin = np.empty(Ndim, int)    # Number of bins in each dimension
+    edges = Ndim * [None]         # Bin edges for each dim (will be 2D array)
+    dedges = Ndim * [None]        # Spacing between edges (will be 2D array)
+
+    # Preserve sample floating point precision in bin edges
+    edges_dtype = (sample.dtype if np.issubdtype(sample.dtype, np.floating)
+                   else float)
+
+    # Select range for each dimension
+    # Used only if number of bins is given.
+    if range is None:
+        smin = np.atleast_1d(np.array(sample.min(axis=0), float))
+        smax = np.atleast_1d(np.array(sample.max(axis=0), float))
+    else:
+        if len(range) != Ndim:
+            raise ValueError(
+                f"range given for {len(range)} dimensions; {Ndim} required")
+        smin = np.empty(Ndim)
+        smax = np.empty(Ndim)
+        for i in builtins.range(Ndim):
+            if range[i][1] < range[i][0]:
+                raise ValueError(
+                    f"In {f'dimension {i + 1} of ' if Ndim > 1 else ''}range,"
+                    " start must be <= stop")
+            smin[i], smax[i] = range[i]
+
+    # Make sure the bins have a finite width.
+    for i in builtins.range(len(smin)):
+        if smin[i] == smax[i]:
+            smin[i] = smin[i] - .5
+            smax[i] = smax[i] + .5
+
+    # Create edge arrays
+    for i in builtins.range(Ndim):
+        if np.isscalar(bins[i]):
+            nbin[i] = bins[i] + 2  # +2 for outlier bins
+            edges[i] = np.linspace(smin[i], smax[i], nbin[i] - 1,
+                                   dtype=edges_dtype)
+        else:
+            edges[i] = np.asarray(bins[i], edges_dtype)
+            nbin[i] = len(edges[i]) + 1  # +1 for outlier bins
+        dedges[i] = np.diff(edges[i])
+
+    nbin = np.asarray(nbin)
+
+    return nbin, edges, dedges
+
+
+def _bin_numbers(sample, nbin, edges, dedges):
+    """Compute the bin number each sample falls into, in each dimension
+    """
+    Dlen, Ndim = sample.shape
+
+    sampBin = [
+        np.digitize(sample[:, i], edges[i])
+        for i in builtins.range(Ndim)
+    ]
+
+    # Using `digitize`, values that fall on an edge are put in the right bin.
+    # For the rightmost bin, we want values equal to the right
+    # edge to be counted in the last bin, and not as an outlier.
+    for i in builtins.range(Ndim):
+        # Find the rounding precision
+        dedges_min = dedges[i].min()
+        if dedges_min == 0:
+            raise ValueError('The smallest edge difference is numerically 0.')
+        decimal = int(-np.log10(dedges_min)) + 6
+        # Find which points are on the rightmost edge.
+        on_edge = np.where((sample[:, i] >= edges[i][-1]) &
+                           (np.around(sample[:, i], decimal) ==
+                            np.around(edges[i][-1], decimal)))[0]
+        # Shift these points one bin to the left.
+        sampBin[i][on_edge] -= 1
+
+    # Compute the sample indices in the flattened statistic matrix.
+    binnumbers = np.ravel_multi_index(sampBin, nbin)
+
+    return binnumbers
@@ -1,7 +1,10 @@
 from typing import Any
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from numpy._typing._array_like import NDArray
 import numpy as np
 import scipy.ndimage
+import scipy.sparse
 
 def generate_kymograph(
     data: NDArray,
@@ -13,10 +16,13 @@ def generate_kymograph(
     n_points: int = 100,
     order: int = 1,
     mode: str = "nearest",
+    chunk_size: int | None = None,
 ) -> NDArray[Any]:
     """
     Generates a kymograph from a multidimensional array.
 
+    The kymograph axis is processed in chunks, so memory use for the sampling coordinates is bounded however long the stack is.
+
     Parameters:
     -----------
     data : np.ndarray
@@ -31,15 +37,119 @@ def generate_kymograph(
         Interpolation order (0=nearest, 1=linear, 3=cubic).
     mode : str
         'constant', 'nearest', 'reflect', or 'wrap'.
+    chunk_size : int, optional
+        Number of kymograph-axis slices interpolated at once. By default chosen so the coordinates of a chunk take about 64 MB, whatever the size of the stack.
 
     Returns:
     --------
     np.ndarray
         Kymograph of shape (kymo_size, n_points, *other_dims).
     """
+    # Coordinate arrays for X and Y (vary along the line axis); the same for every chunk
+    line_coords = np.linspace(p1[0], p2[0], n_points)
+    y_line_coords = np.linspace(p1[1], p2[1], n_points)
+    return _sample_lines(data, line_coords, y_line_coords, x_dim, y_dim, kymo_dim, order, mode, chunk_size)
+
+
+def generate_kymographs(
+    data: NDArray,
+    lines: Sequence[Sequence[tuple[float, float]]],
+    x_dim: int,
+    y_dim: int,
+    kymo_dim: int,
+    n_points: int = 100,
+    linewidth: int = 1,
+    order: int = 1,
+    mode: str = "nearest",
+    chunk_size: int | None = None,
+    workers: int = 1,
+) -> NDArray[Any]:
+    """
+    Generates kymographs along many lines at once, optionally averaged over a width perpendicular to the line.
+
+    All lines are sampled in one interpolation over the stack (chunked along the kymograph axis, like `generate_kymograph`), instead of one pass over the data per line.
+
+    Parameters:
+    -----------
+    data : np.ndarray
+        Input array.
+    lines : sequence of sequences of (x, y)
+        Lines to sample along: a line segment is ``[p1, p2]``, a polyline is a longer list of vertices. Points are spread evenly over the length of a polyline.
+    x_dim, y_dim, kymo_dim : int
+        Indices for the x, y, and kymograph (e.g., time) axes.
+    n_points : int
+        Number of points along every line.
+    linewidth : int
+        Number of parallel lines, 1 pixel apart and centred on the line, to average over.
+    order : int
+        Interpolation order (0=nearest, 1=linear, 3=cubic).
+    mode : str
+        'constant', 'nearest', 'reflect', or 'wrap'.
+    chunk_size : int, optional
+        Number of kymograph-axis slices interpolated at once, by default about 64 MB of coordinates.
+    workers : int
+        Number of threads interpolating chunks concurrently.
+
+    Returns:
+    --------
+    np.ndarray
+        Kymographs of shape (n_lines, kymo_size, n_points, *other_dims). A segment with linewidth 1 gives the same kymograph as `generate_kymograph`; with a larger linewidth the result is floating point.
+    """
+    xs, ys = [], []
+    for line in lines:
+        x, y, normal = _polyline_points(np.asarray(line, dtype=np.float64), n_points)
+        offsets = np.linspace(-(linewidth - 1) / 2, (linewidth - 1) / 2, linewidth)[:, np.newaxis]
+        xs.append(x + offsets * normal[0])
+        ys.append(y + offsets * normal[1])
+    n_lines = len(xs)
+    dtype = data.dtype if linewidth == 1 else np.float64
+    kymo = _sample_lines(
+        data, np.ravel(xs), np.ravel(ys), x_dim, y_dim, kymo_dim, order, mode, chunk_size, workers=workers, dtype=dtype
+    )
+    kymo = kymo.reshape(kymo.shape[0], n_lines, linewidth, n_points, *kymo.shape[2:])
+    if linewidth > 1:
+        kymo = kymo.mean(axis=2, keepdims=True)
+    return np.moveaxis(kymo[:, :, 0], 1, 0)
+
+
+def _polyline_points(vertices: NDArray[np.float64], n_points: int) -> tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    """x and y of `n_points` points spread evenly along a polyline, and the unit normal of the segment each point is on."""
+    if vertices.ndim != 2 or vertices.shape[1] != 2 or len(vertices) < 2:
+        raise ValueError(f"a line should be a sequence of at least two (x, y) points, not {vertices.tolist()}.")
+    steps = np.diff(vertices, axis=0)
+    lengths = np.hypot(*steps.T)
+    if len(vertices) == 2:
+        # same points as generate_kymograph
+        x, y = np.linspace(vertices[0, 0], vertices[1, 0], n_points), np.linspace(vertices[0, 1], vertices[1, 1], n_points)
+        segment = np.zeros(n_points, dtype=np.intp)
+    else:
+        distance = np.concatenate([[0], np.cumsum(lengths)])
+        targets = np.linspace(0, distance[-1], n_points)
+        x, y = np.interp(targets, distance, vertices[:, 0]), np.interp(targets, distance, vertices[:, 1])
+        segment = np.clip(np.searchsorted(distance, targets, side="right") - 1, 0, len(steps) - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normal = np.array([-steps[:, 1], steps[:, 0]]) / lengths
+    return x, y, np.nan_to_num(normal)[:, segment]
+
+
+def _sample_lines(
+    data: NDArray,
+    line_coords: NDArray[Any],
+    y_line_coords: NDArray[Any],
+    x_dim: int,
+    y_dim: int,
+    kymo_dim: int,
+    order: int,
+    mode: str,
+    chunk_size: int | None = None,
+    workers: int = 1,
+    dtype: Any = None,
+) -> NDArray[Any]:
+    """Interpolate `data` at points (x, y) for every index along `kymo_dim`; returns shape (kymo_size, n_points, *other_sizes)."""
     # Identify dimensions
     ndim = data.ndim
     all_dims = np.arange(ndim)
+    n_points = len(line_coords)
 
     # Separate dimensions: Spatial, Time, and "Other" (Data values)
     # We fix the order for the output grid: (Kymo, Line, *Other)
@@ -49,50 +159,326 @@ def generate_kymograph(
     kymo_size = data.shape[kymo_dim]
     other_sizes = [data.shape[d] for d in other_dims]
 
-    # Prepare coordinate arrays for the grid
-    # We use a meshgrid-like approach by creating arrays of correct shape to broadcast
-
-    # Coordinate arrays for X and Y (vary along the line axis)
-    line_coords = np.linspace(p1[0], p2[0], n_points)
-    y_line_coords = np.linspace(p1[1], p2[1], n_points)
+    # All other coordinates are integers, so float32 is exact for them; use it unless it would move the line
+    coord_dtype = _coordinate_dtype(line_coords, y_line_coords, max(data.shape))
+    if chunk_size is None:
+        per_frame = ndim * n_points * int(np.prod(other_sizes)) * np.dtype(coord_dtype).itemsize
+        chunk_size = max(1, _KYMOGRAPH_CHUNK_BYTES // max(per_frame, 1))
+        # give every worker something to do
+        chunk_size = min(chunk_size, max(-(-kymo_size // workers), 1))
+    chunk_size = min(chunk_size, max(kymo_size, 1))
 
+    # Coordinates for one chunk of the kymograph axis; map_coordinates expects (ndim, *output_shape)
+    # We must fill the slots corresponding to the specific axes of the input data
+    coords = np.empty((ndim, chunk_size, n_points, *other_sizes), dtype=coord_dtype)
     # Reshape for broadcasting: (1, n_points, 1, ..., 1)
-    # Prepending 1s for Kymo and Other dims
     line_shape = [1, n_points] + [1] * len(other_dims)
-    x_grid = line_coords.reshape(line_shape)
-    y_grid = y_line_coords.reshape(line_shape)
-
-    # Coordinate array for Kymo dimension (vary along first axis)
-    # Shape: (kymo_size, 1, 1, ..., 1)
-    kymo_coords = np.arange(kymo_size)
-    kymo_shape = [kymo_size, 1] + [1] * len(other_dims)
-    kymo_grid = kymo_coords.reshape(kymo_shape)
-
-    # Coordinate arrays for Other dimensions (vary along their respective trailing axes)
-    other_grids = []
+    coords[x_dim] = line_coords.reshape(line_shape)
+    coords[y_dim] = y_line_coords.reshape(line_shape)
+    # Kymo coordinates count from the start of the chunk, because every chunk is interpolated from its own slice of data
+    coords[kymo_dim] = np.arange(chunk_size).reshape([chunk_size, 1] + [1] * len(other_dims))
     for i, dim_idx in enumerate(other_dims):
-        size = data.shape[dim_idx]
-        # Shape: (1, 1, ..., size, ..., 1)
-        # The 'size' is at position 2 + i
+        # Shape: (1, 1, ..., size, ..., 1), with 'size' at position 2 + i
         target_shape = [1, 1] + [1] * len(other_dims)
-        target_shape[2 + i] = size
-        other_grids.append(np.arange(size).reshape(target_shape))
+        target_shape[2 + i] = other_sizes[i]
+        coords[dim_idx] = np.arange(other_sizes[i]).reshape(target_shape)
 
-    # Assemble full coordinates array for map_coordinates
-    # map_coordinates expects (ndim, *output_shape)
-    # We must fill the slots corresponding to the specific axes of the input data
+    # Interpolate chunk by chunk, straight into the output
+    kymo = np.empty((kymo_size, n_points, *other_sizes), dtype=data.dtype if dtype is None else dtype)
 
-    full_coords = np.zeros((ndim, kymo_size, n_points, *other_sizes))
+    def interpolate(start: int) -> None:
+        stop = min(start + chunk_size, kymo_size)
+        chunk = [slice(None)] * ndim
+        chunk[kymo_dim] = slice(start, stop)
+        scipy.ndimage.map_coordinates(
+            data[tuple(chunk)], coords[:, : stop - start], output=kymo[start:stop], order=order, mode=mode
+        )
 
-    # Assign grids to their respective coordinate indices
-    full_coords[x_dim] = x_grid
-    full_coords[y_dim] = y_grid
-    full_coords[kymo_dim] = kymo_grid
+    starts = range(0, kymo_size, chunk_size)
+    if workers > 1:
+        # map_coordinates releases the GIL, so chunks interpolate in parallel
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(interpolate, starts))
+    else:
+        for start in starts:
+            interpolate(start)
 
-    for i, dim_idx in enumerate(other_dims):
-        full_coords[dim_idx] = other_grids[i]
+    return kymo
 
-    # Interpolate
-    kymo = scipy.ndimage.map_coordinates(data, full_coords, order=order, mode=mode)
 
-    return kymo
+# memory budget for the coordinates of one chunk of a kymograph
+_KYMOGRAPH_CHUNK_BYTES = 2**26
+
+
+def _coordinate_dtype(x: NDArray[Any], y: NDArray[Any], max_index: int) -> type:
+    """float32 if it represents the line coordinates and all integer indices exactly, float64 otherwise."""
+    exact = max_index < 2**24 and all(np.array_equal(c.astype(np.float32), c) for c in (x, y))
+    return np.float32 if exact else np.float64
+
+
+class KymographPlan:
+    """
+    Precomputed sampling of a line ROI, to make kymographs of many stacks with the same frame shape.
+
+    The interpolation along the line from `p1` to `p2` is stored as a sparse (n_points x H*W) matrix, so a batch of frames is sampled with a single sparse matrix product. For spline orders above 1, frames are first spline-filtered, like `scipy.ndimage.map_coordinates` does. Results match `generate_kymograph` (with the frames' y and x as `y_dim` and `x_dim`) to floating point rounding.
+
+    Plans can be pickled, or stored with `save` and `load`, to reuse them across files and worker processes.
+
+    Parameters
+    ----------
+    p1, p2 : tuple of float
+        (x, y) start and end coordinates for the line.
+    frame_shape : tuple of int
+        (H, W) of the frames the plan will be applied to.
+    n_points : int
+        Number of points along the line.
+    order : int
+        Interpolation order (0=nearest, 1=linear, 3=cubic).
+    mode : str
+        'constant', 'nearest', 'reflect', or 'wrap'.
+
+    Examples
+    --------
+    >>> plan = KymographPlan((10, 20), (200, 180), frame_shape=(512, 512))
+    >>> kymo = plan.apply(load_tiff("cell.tif"))  # (n_frames, 100)
+    """
+
+    def __init__(
+        self,
+        p1: tuple[float, float],
+        p2: tuple[float, float],
+        frame_shape: tuple[int, int],
+        n_points: int = 100,
+        order: int = 1,
+        mode: str = "nearest",
+    ) -> None:
+        self.p1 = tuple(p1)
+        self.p2 = tuple(p2)
+        self.frame_shape = tuple(int(i) for i in frame_shape[:2])
+        self.n_points = n_points
+        self.order = order
+        self.mode = mode
+        # map_coordinates pads the input before spline filtering in these modes; do the same so results match
+        self._pad = 12 if order > 1 and mode in ("nearest", "grid-constant") else 0
+        self.matrix = self._sampling_matrix()
+        self._pixels, self._weights = _used_columns(self.matrix)
+
+    def apply(self, frames: NDArray[Any], dtype: Any = np.float64) -> NDArray[Any]:
+        """
+        Sample the line in a batch of frames.
+
+        Parameters
+        ----------
+        frames : NDArray[Any]
+            Frames of shape (N, H, W, *other), e.g. a batch from `stream_video`.
+        dtype : optional
+            Dtype of the result, by default np.float64.
+
+        Returns
+        -------
+        NDArray[Any]
+            Kymograph of shape (N, n_points, *other).
+        """
+        frames = np.asarray(frames)
+        if frames.shape[1:3] != self.frame_shape:
+            raise ValueError(f"frames of shape {frames.shape[1:3]} do not match the plan's frame shape {self.frame_shape}.")
+        n, other = len(frames), frames.shape[3:]
+        kymo = np.empty((n, self.n_points, *other), dtype=dtype)
+        if self.order <= 1:
+            kymo[...] = self._sample(frames)
+            return kymo
+        # spline filtering makes float64 copies of whole frames; do a few frames at a time
+        chunk_size = max(1, _KYMOGRAPH_CHUNK_BYTES // (8 * max(frames[0].size, 1)))
+        for start in range(0, n, chunk_size):
+            kymo[start : start + chunk_size] = self._sample(self._spline_filter(frames[start : start + chunk_size]))
+        return kymo
+
+    def _sample(self, frames: NDArray[Any]) -> NDArray[np.float64]:
+        """Apply the sampling matrix to (N, H, W, *other) frames (spline coefficients for orders above 1)."""
+        n, other = len(frames), frames.shape[3:]
+        n_other = int(np.prod(other))
+        # only the pixels the line passes over are read: (N, pixels, other) -> (pixels, N*other), one product for the batch
+        pixels = frames.reshape(n, -1, n_other)[:, self._pixels]
+        sampled = self._weights @ pixels.transpose(1, 0, 2).reshape(len(self._pixels), n * n_other).astype(np.float64)
+        return np.moveaxis(sampled.reshape(self.n_points, n, *other), 0, 1)
+
+    def save(self, path: str | Any) -> None:
+        """Store the plan in a .npz file."""
+        np.savez(
+            path,
+            p1=self.p1, p2=self.p2, frame_shape=self.frame_shape, n_points=self.n_points, order=self.order, mode=self.mode,
+            data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr, shape=self.matrix.shape,
+        )
+
+    @classmethod
+    def load(cls, path: str | Any) -> "KymographPlan":
+        """Read a plan stored with `save`."""
+        with np.load(path) as stored:
+            plan = cls.__new__(cls)
+            plan.p1, plan.p2 = tuple(stored["p1"]), tuple(stored["p2"])
+            plan.frame_shape = tuple(int(i) for i in stored["frame_shape"])
+            plan.n_points, plan.order, plan.mode = int(stored["n_points"]), int(stored["order"]), str(stored["mode"])
+            plan._pad = 12 if plan.order > 1 and plan.mode in ("nearest", "grid-constant") else 0
+            plan.matrix = scipy.sparse.csr_matrix(
+                (stored["data"], stored["indices"], stored["indptr"]), shape=tuple(stored["shape"])
+            )
+            plan._pixels, plan._weights = _used_columns(plan.matrix)
+        return plan
+
+    def _spline_filter(self, frames: NDArray[Any]) -> NDArray[np.float64]:
+        """Spline-filter frames along y and x, padded like map_coordinates does."""
+        pad = self._pad
+        if pad:
+            widths = [(0, 0), (pad, pad), (pad, pad)] + [(0, 0)] * (frames.ndim - 3)
+            frames = np.pad(frames, widths, mode="edge" if self.mode == "nearest" else "constant")
+        filtered = scipy.ndimage.spline_filter1d(frames, self.order, axis=1, output=np.float64, mode=self.mode)
+        return scipy.ndimage.spline_filter1d(filtered, self.order, axis=2, output=np.float64, mode=self.mode)
+
+    def _sampling_matrix(self) -> scipy.sparse.csr_matrix:
+        """
+        Find the interpolation weights of every point on the line, by sampling probe images with map_coordinates.
+
+        Each point only depends on a (order + 1) x (order + 1) footprint of (spline coefficient) pixels. Pixels are split in classes by their index modulo `period`; if a footprint has at most one pixel of every class, sampling the indicator image of a class gives that pixel's weight, and sampling the same image weighted by pixel index tells which pixel it is. The result is checked against map_coordinates on a random image.
+        """
+        height, width = (size + 2 * self._pad for size in self.frame_shape)
+        coords = np.array([
+            np.linspace(self.p1[1], self.p2[1], self.n_points) + self._pad,
+            np.linspace(self.p1[0], self.p2[0], self.n_points) + self._pad,
+        ])
+        sample = lambda image: scipy.ndimage.map_coordinates(image, coords, order=self.order, mode=self.mode, prefilter=False)
+        index = np.arange(height * width, dtype=np.float64).reshape(height, width)
+        test_image = np.random.default_rng(0).random((height, width))
+        footprint = self.order + 1
+        for period in range(footprint, 4 * footprint + 1):
+            rows, cols, weights = [], [], []
+            for a in range(period):
+                for b in range(period):
+                    probe = ((np.arange(height) % period == a)[:, np.newaxis] & (np.arange(width) % period == b)).astype(np.float64)
+                    weight = sample(probe)
+                    hit = weight != 0
+                    rows.append(np.flatnonzero(hit))
+                    cols.append(np.rint(sample(probe * index)[hit] / weight[hit]).astype(np.intp))
+                    weights.append(weight[hit])
+            matrix = scipy.sparse.csr_matrix(
+                (np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))), shape=(self.n_points, height * width)
+            )
+            if np.allclose(matrix @ test_image.ravel(), sample(test_image), rtol=0, atol=1e-10):
+                return matrix
+        raise RuntimeError(f"could not determine the sampling weights for order {self.order} and mode {self.mode!r}.")
+
+
+def _used_columns(matrix: scipy.sparse.csr_matrix) -> tuple[NDArray[np.intp], scipy.sparse.csr_matrix]:
+    """Indices of the columns of a sparse matrix that hold any weight, and the matrix with only those columns."""
+    pixels = np.unique(matrix.indices)
+    return pixels, matrix[:, pixels].tocsr()
+
+
+class KymographBuilder:
+    """
+    Build a kymograph along a line from batches of frames, e.g. from `stream_video`, without holding the whole stack in memory.
+
+    Every batch is sampled with a `KymographPlan` (made from the frame shape of the first batch, unless given) and its rows are written into the kymograph, so peak memory is one batch plus the kymograph.
+
+    Parameters
+    ----------
+    p1, p2 : tuple of float, optional
+        (x, y) start and end coordinates for the line. Not needed if `plan` is given.
+    n_points : int
+        Number of points along the line.
+    order : int
+        Interpolation order (0=nearest, 1=linear, 3=cubic).
+    mode : str
+        'constant', 'nearest', 'reflect', or 'wrap'.
+    plan : KymographPlan, optional
+        Precomputed plan to sample with, instead of making one from the arguments above.
+    n_frames : int, optional
+        Expected number of frames, to allocate the kymograph once. It grows as needed if there turn out to be more.
+    dtype : optional
+        Dtype of the kymograph, by default np.float64.
+
+    Examples
+    --------
+    >>> builder = KymographBuilder((10, 20), (200, 180))
+    >>> for batch in stream_video("movie.mp4", pix_fmt="gray"):
+    ...     builder.update(batch)
+    >>> builder.kymograph.shape
+    (n_frames, 100)
+    """
+
+    def __init__(
+        self,
+        p1: tuple[float, float] | None = None,
+        p2: tuple[float, float] | None = None,
+        n_points: int = 100,
+        order: int = 1,
+        mode: str = "nearest",
+        plan: KymographPlan | None = None,
+        n_frames: int | None = None,
+        dtype: Any = np.float64,
+    ) -> None:
+        if plan is None and (p1 is None or p2 is None):
+            raise ValueError("give either p1 and p2, or a plan.")
+        self.p1, self.p2 = p1, p2
+        self.n_points, self.order, self.mode = n_points, order, mode
+        self.plan = plan
+        self.dtype = dtype
+        self._expected = n_frames or 0
+        self._kymograph: NDArray[Any] | None = None
+        self.n_seen = 0
+
+    @property
+    def kymograph(self) -> NDArray[Any]:
+        """Kymograph of all frames so far, shape (n_frames, n_points, *other)."""
+        if self._kymograph is None:
+            raise ValueError("no frames seen yet.")
+        return self._kymograph[: self.n_seen]
+
+    def update(self, batch: NDArray[Any]) -> None:
+        """Sample a batch of (N, H, W, *other) frames, and add it to the kymograph."""
+        batch = np.asarray(batch)
+        if self.plan is None:
+            self.plan = KymographPlan(self.p1, self.p2, batch.shape[1:3], self.n_points, self.order, self.mode)
+        if self._kymograph is None:
+            shape = (max(self._expected, len(batch)), self.plan.n_points, *batch.shape[3:])
+            self._kymograph = np.empty(shape, dtype=self.dtype)
+        stop = self.n_seen + len(batch)
+        if stop > len(self._kymograph):
+            # more frames than expected; grow geometrically so long streams stay linear. Copy into a new buffer
+            # rather than resizing in place, so views handed out by `kymograph` stay valid.
+            grown = np.empty((max(stop, 2 * len(self._kymograph)), *self._kymograph.shape[1:]), dtype=self._kymograph.dtype)
+            grown[: self.n_seen] = self._kymograph[: self.n_seen]
+            self._kymograph = grown
+        self._kymograph[self.n_seen : stop] = self.plan.apply(batch)
+        self.n_seen = stop
+
+    def finish(self) -> NDArray[Any]:
+        """Trim the kymograph to the frames seen, releasing any unused rows, and return it."""
+        if self._kymograph is not None and len(self._kymograph) > self.n_seen:
+            self._kymograph = self._kymograph[: self.n_seen].copy()
+        return self.kymograph
+
+
+def stream_kymograph(
+    batches: Iterable[NDArray[Any]],
+    p1: tuple[float, float] | None = None,
+    p2: tuple[float, float] | None = None,
+    n_points: int = 100,
+    order: int = 1,
+    mode: str = "nearest",
+    plan: KymographPlan | None = None,
+    n_frames: int | None = None,
+) -> NDArray[Any]:
+    """
+    Kymograph along a line through a stream of frame batches, e.g. ``stream_kymograph(stream_video(path, pix_fmt="gray"), p1, p2)``.
+
+    Same result as `generate_kymograph` on the whole stack (with time as `kymo_dim`, and the frames' y and x as `y_dim` and `x_dim`), but only one batch is in memory at a time. See `KymographBuilder` for the parameters.
+
+    Returns
+    -------
+    np.ndarray
+        Kymograph of shape (n_frames, n_points, *other), float64.
+    """
+    builder = KymographBuilder(p1, p2, n_points=n_points, order=order, mode=mode, plan=plan, n_frames=n_frames)
+    for batch in batches:
+        builder.update(batch)
+    return builder.finish()
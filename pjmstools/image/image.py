@@ -1,32 +1,426 @@
 from numpy._typing._array_like import NDArray
 
 
-from typing import Any
+from typing import Any, IO
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 
-import warnings
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+import time
 import numpy as np
 import ffmpeg
+import tifffile
 from pathlib import Path
 
-def contrast_normalize(image:np.ndarray, maxpx:int = 255) -> np.ndarray:
-    """Renormalize contrast to outer bounds. Does not change datatype! Only input np.array's!"""
-    return ((image - np.min(image)) / (np.max(image) - np.min(image))) * maxpx
+def contrast_normalize(
+    image: np.ndarray, maxpx: int = 255, out: np.ndarray | None = None, dtype: Any = None
+) -> np.ndarray:
+    """
+    Renormalize contrast to outer bounds: map the minimum of `image` to 0 and the maximum to `maxpx`.
+
+    Works through the image in small blocks, so apart from the result no full-size temporaries are made; min and max are found in a single pass over memory. uint8 and uint16 images are mapped through a lookup table. A constant image maps to 0.
+
+    Parameters
+    ----------
+    image : np.ndarray
+        Image or stack of images, of any shape.
+    maxpx : int, optional
+        Value the maximum is mapped to, by default 255.
+    out : np.ndarray | None, optional
+        Array to write the result to, with the shape of `image`; can be `image` itself to normalize in place. By default None (a new array).
+    dtype : optional
+        Dtype of the result if `out` is not given; for integer dtypes values are rounded. By default None: the dtype of floating point images, float64 for others.
+
+    Returns
+    -------
+    np.ndarray
+        Normalized image (`out`, if given).
+    """
+    low, high = _minmax(image)
+    return _rescale(image, low, high, maxpx, out=out, dtype=dtype)
+
+
+def autocontrast(
+    image: np.ndarray,
+    cliprange: float = 2,
+    maxpx: int = 255,
+    out: np.ndarray | None = None,
+    dtype: Any = None,
+    mode: str = "global",
+) -> np.ndarray:
+    """
+    Autocontrast to outer bounds + cliprange in %: map the `cliprange` and 100 - `cliprange` percentiles to 0 and `maxpx`, clipping values outside.
+
+    Like `contrast_normalize`, this works blockwise, uses a lookup table for uint8 and uint16 images, and can write to `out` (also in place) or to a result of another `dtype` (e.g. ``dtype=np.uint8`` to stay uint8). For 8 and 16 bit integer images the percentiles are read from a histogram, instead of sorting a copy of the image.
+
+    `mode` sets what the percentiles are taken over: "global" uses the whole array, "frame" clips every frame (along axis 0) of a stack separately. To autocontrast a video that does not fit in memory, use `RunningAutocontrast` on the batches of `stream_video`.
+    """
+    qs = (cliprange, 100 - cliprange)
+    if mode == "global":
+        minval, maxval = _percentiles(image, qs)
+        return _rescale(image, minval, maxval, maxpx, out=out, dtype=dtype)
+    if mode != "frame":
+        raise ValueError(f"mode should be 'global' or 'frame', not {mode!r}.")
+    if np.ndim(image) < 2:
+        raise ValueError("mode='frame' needs a stack of frames.")
+    limits = _percentiles(image, qs, per_frame=True)
+    out = _output_array(image, out, dtype)
+    for frame, frame_out, (minval, maxval) in zip(image, out, limits.T):
+        _rescale(frame, minval, maxval, maxpx, out=frame_out)
+    return out
+
+
+class RunningAutocontrast:
+    """
+    Autocontrast a stack batch by batch, with clip points estimated from all batches seen so far.
+
+    Every batch updates a running histogram (exact for 8 and 16 bit integer frames) and is then mapped with the `cliprange` percentiles of everything seen up to and including it. For frames that all look alike, the estimate settles after the first few batches, so a whole video can be autocontrasted in one streaming pass. For other dtypes, the running clip points are the average of the per-batch percentiles, weighted by batch size.
+
+    Parameters
+    ----------
+    cliprange : float, optional
+        Percentage clipped at both ends, by default 2.
+    maxpx : int, optional
+        Value the upper clip point is mapped to, by default 255.
+    dtype : optional
+        Dtype of the output, by default np.uint8.
+
+    Examples
+    --------
+    >>> running = RunningAutocontrast(cliprange=1)
+    >>> write_video("out.mp4", (running(batch) for batch in stream_video("in.mp4", pix_fmt="gray")))
+    """
+
+    def __init__(self, cliprange: float = 2, maxpx: int = 255, dtype: Any = np.uint8) -> None:
+        self.cliprange = cliprange
+        self.maxpx = maxpx
+        self.dtype = dtype
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all batches seen so far."""
+        self._histogram: NDArray[np.int64] | None = None
+        self._offset = 0
+        self._weighted_limits = np.zeros(2)
+        self.n_seen = 0
+
+    @property
+    def limits(self) -> tuple[float, float]:
+        """Current estimate of the lower and upper clip points."""
+        if self.n_seen == 0:
+            raise ValueError("no frames seen yet.")
+        if self._histogram is not None:
+            low, high = _histogram_percentiles(self._histogram, (self.cliprange, 100 - self.cliprange))
+            return low + self._offset, high + self._offset
+        low, high = self._weighted_limits / self.n_seen
+        return low, high
+
+    def update(self, batch: np.ndarray) -> None:
+        """Add a batch to the running estimate, without mapping it."""
+        batch = np.asarray(batch)
+        if batch.size == 0:
+            return
+        if batch.dtype.kind in "ui" and batch.dtype.itemsize <= 2:
+            histogram, self._offset = _histogram(batch)
+            self._histogram = histogram if self._histogram is None else self._histogram + histogram
+        else:
+            self._weighted_limits += batch.size * np.asarray(_percentiles(batch, (self.cliprange, 100 - self.cliprange)))
+        self.n_seen += batch.size
+
+    def apply(self, batch: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        """Map a batch with the current clip points, without adding it to the estimate."""
+        low, high = self.limits
+        return _rescale(batch, low, high, self.maxpx, out=out, dtype=self.dtype)
+
+    def __call__(self, batch: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+        """Add a batch to the running estimate, and map it with the updated clip points."""
+        self.update(batch)
+        return self.apply(batch, out=out)
+
+
+def _histogram(image: np.ndarray) -> tuple[NDArray[np.int64], int]:
+    """Histogram of an 8 or 16 bit integer array, with one bin per possible value; returns counts and the value of the first bin."""
+    info = np.iinfo(image.dtype)
+    counts = np.zeros(info.max - info.min + 1, dtype=np.int64)
+    for (block,) in _blocks(image):
+        values = block.reshape(-1)
+        if info.min:
+            values = values.astype(np.int32) - info.min
+        counts += np.bincount(values, minlength=len(counts))
+    return counts, int(info.min)
+
+
+def _histogram_percentiles(histogram: np.ndarray, qs: tuple[float, ...]) -> NDArray[np.float64]:
+    """Percentiles (in bin units) of values counted in a 1D `histogram`, interpolated like np.percentile's default "linear" method."""
+    cumulative = np.cumsum(histogram)
+    position = (cumulative[-1] - 1) * (np.asarray(qs, dtype=np.float64) / 100)
+    below = np.floor(position)
+    # the value at (0-based) rank r is the number of bins holding at most r values
+    low = np.searchsorted(cumulative, below, side="right")
+    high = np.searchsorted(cumulative, np.ceil(position), side="right")
+    return low + (high - low) * (position - below)
+
+
+def _percentiles(image: np.ndarray, qs: tuple[float, ...], per_frame: bool = False) -> NDArray[np.float64]:
+    """Percentiles of an image (or, with `per_frame`, of every frame along axis 0, shape (len(qs), n_frames)); from a histogram for 8 and 16 bit integers."""
+    image = np.asarray(image)
+    if image.dtype.kind in "ui" and image.dtype.itemsize <= 2:
+        if per_frame:
+            # one frame's histogram at a time, keeping only its percentiles
+            limits = np.empty((len(qs), len(image)), dtype=np.float64)
+            for i, frame in enumerate(image):
+                histogram, offset = _histogram(frame)
+                limits[:, i] = _histogram_percentiles(histogram, qs) + offset
+            return limits
+        histogram, offset = _histogram(image)
+        return _histogram_percentiles(histogram, qs) + offset
+    if per_frame:
+        return np.percentile(image.reshape(len(image), -1), qs, axis=1)
+    return np.percentile(image, qs)
+
+
+# number of elements processed at once by the blockwise image operations; small enough to stay in cache
+_BLOCK_SIZE = 2**18
+
+
+def _blocks(*arrays: np.ndarray) -> Iterator[tuple[np.ndarray, ...]]:
+    """Matching views into blocks of about `_BLOCK_SIZE` elements of equally shaped arrays."""
+    if all(a.flags.c_contiguous for a in arrays):
+        flat = [a.reshape(-1) for a in arrays]
+        for start in range(0, flat[0].size, _BLOCK_SIZE):
+            yield tuple(a[start : start + _BLOCK_SIZE] for a in flat)
+    elif arrays[0].ndim == 1:
+        for start in range(0, arrays[0].size, _BLOCK_SIZE):
+            yield tuple(a[start : start + _BLOCK_SIZE] for a in arrays)
+    elif arrays[0][0].size < _BLOCK_SIZE:
+        # strided (e.g. a view of a memmap): take as many leading-axis slices as fit in a block
+        step = max(_BLOCK_SIZE // max(arrays[0][0].size, 1), 1)
+        for start in range(0, len(arrays[0]), step):
+            yield tuple(a[start : start + step] for a in arrays)
+    else:
+        for i in range(len(arrays[0])):
+            yield from _blocks(*(a[i] for a in arrays))
+
+
+def _minmax(image: np.ndarray) -> tuple[Any, Any]:
+    """Minimum and maximum of an array, in one pass over memory (each block is scanned twice, while it is in cache)."""
+    if image.size == 0:
+        raise ValueError("can not normalize an empty image.")
+    low, high = None, None
+    for (block,) in _blocks(image):
+        block_low, block_high = block.min(), block.max()
+        low = block_low if low is None else np.minimum(low, block_low)
+        high = block_high if high is None else np.maximum(high, block_high)
+    return low, high
+
+
+def _rescale(
+    image: np.ndarray, low: Any, high: Any, maxpx: int, out: np.ndarray | None = None, dtype: Any = None
+) -> np.ndarray:
+    """Linearly map `low` to 0 and `high` to `maxpx`, clipping values outside; blockwise, with a lookup table for uint8/uint16."""
+    image = np.asarray(image)
+    out = _output_array(image, out, dtype)
+    low, high = float(low), float(high)
+    scale = maxpx / (high - low) if high > low else 0.0
+    round_output = not np.issubdtype(out.dtype, np.inexact)
+
+    if image.dtype in (np.uint8, np.uint16):
+        # every possible pixel value, mapped once
+        lut = np.arange(np.iinfo(image.dtype).max + 1, dtype=np.float64)
+        lut = _map_values(lut, low, scale, maxpx, round_output).astype(out.dtype)
+        for block, out_block in _blocks(image, out):
+            np.take(lut, block, out=out_block, mode="clip")
+        return out
+
+    for block, out_block in _blocks(image, out):
+        out_block[...] = _map_values(block.astype(np.float64), low, scale, maxpx, round_output)
+    return out
+
+
+def _output_array(image: np.ndarray, out: np.ndarray | None, dtype: Any) -> np.ndarray:
+    """Check `out`, or allocate it: by default floating point images keep their dtype, others get float64."""
+    if out is None:
+        if dtype is None:
+            dtype = image.dtype if np.issubdtype(image.dtype, np.floating) else np.float64
+        return np.empty(np.shape(image), dtype=dtype)
+    if out.shape != np.shape(image):
+        raise ValueError(f"out has shape {out.shape}, but image has shape {np.shape(image)}.")
+    return out
+
+
+def _map_values(values: np.ndarray, low: float, scale: float, maxpx: int, round_output: bool) -> np.ndarray:
+    """(values - low) * scale, clipped to [0, maxpx]; in place on a float64 array."""
+    values -= low
+    values *= scale
+    np.clip(values, 0, maxpx, out=values)
+    if round_output:
+        np.rint(values, out=values)
+    return values
+
+
+def _probe_video(path: Path | str) -> dict[str, Any]:
+    """Properties of the first video stream in a file, as reported by ffprobe."""
+    probe = ffmpeg.probe(str(path))
+    for stream in probe["streams"]:
+        if stream.get("codec_type") == "video":
+            # some containers (mkv, webm) only report the duration of the file as a whole
+            stream.setdefault("duration", probe["format"].get("duration"))
+            return stream
+    raise ValueError(f"{path} contains no video stream.")
+
+
+def _count_frames(probe: dict[str, Any]) -> int:
+    """Number of frames in a video stream; estimated from duration and frame rate if the container does not say."""
+    if "nb_frames" in probe:
+        return int(probe["nb_frames"])
+    if probe.get("duration") is None:
+        return 0
+    return round(float(probe["duration"]) * _frame_rate(probe))
+
 
-def autocontrast(image:np.ndarray, cliprange:float = 2, maxpx:int = 255) -> np.ndarray:
-    """Autocontrast to outer bounds + cliprange in %. Does not change datatype! Only input np.array's!"""
-    minval = np.percentile(image, cliprange)
-    maxval = np.percentile(image, 100 - cliprange)
-    pixvals = np.clip(image, minval, maxval)
-    return ((pixvals - minval) / (maxval - minval)) * maxpx
+def _frame_rate(probe: dict[str, Any]) -> float:
+    """Average frame rate of a video stream, in frames per second (0 if unknown)."""
+    num, den = (int(i) for i in probe["avg_frame_rate"].split("/"))
+    return num / den if den else 0.0
 
 
-def stream_video(path: Path | str, batch_size: int = 100) -> NDArray[Any]:
+def _keyframe_times(path: Path | str, probe: dict[str, Any]) -> NDArray[np.float64]:
+    """Sorted presentation times (in seconds, from the start of the video) of all keyframes. Only reads packet headers, no decoding."""
+    packets = ffmpeg.probe(str(path), select_streams=f"{probe['index']}", show_entries="packet=pts_time,flags")["packets"]
+    offset = float(probe.get("start_time", 0))
+    return np.sort(
+        [float(packet["pts_time"]) - offset for packet in packets if "K" in packet.get("flags", "") and "pts_time" in packet]
+    )
+
+
+# supported output pixel formats: trailing (channel) axes of a frame, and dtype
+_PIX_FMTS: dict[str, tuple[tuple[int, ...], np.dtype]] = {
+    "rgb24": ((3,), np.dtype(np.uint8)),
+    "gray": ((), np.dtype(np.uint8)),
+    "gray16le": ((), np.dtype("<u2")),
+}
+
+
+def _frame_format(
+    probe: dict[str, Any],
+    pix_fmt: str = "rgb24",
+    crop: tuple[int, int, int, int] | None = None,
+    size: tuple[int, int] | None = None,
+) -> tuple[tuple[int, ...], np.dtype]:
+    """Check output options against a probed video stream; returns the shape of one output frame and its dtype."""
+    if pix_fmt not in _PIX_FMTS:
+        raise ValueError(f"pix_fmt must be one of {list(_PIX_FMTS)}, not {pix_fmt!r}.")
+    channels, dtype = _PIX_FMTS[pix_fmt]
+    width, height = probe["width"], probe["height"]
+    if crop is not None:
+        x, y, width, height = crop
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > probe["width"] or y + height > probe["height"]:
+            raise ValueError(f"crop {crop} does not fit in a {probe['width']}x{probe['height']} video.")
+    if size is not None:
+        width, height = size
+        if width <= 0 or height <= 0:
+            raise ValueError(f"size must be a positive (width, height), not {size}.")
+    return (height, width, *channels), dtype
+
+
+def _open_video(
+    path: Path | str,
+    every_n_frames: int = 1,
+    pix_fmt: str = "rgb24",
+    crop: tuple[int, int, int, int] | None = None,
+    size: tuple[int, int] | None = None,
+    probe: dict[str, Any] | None = None,
+    start: float | None = None,
+    seek: float | None = None,
+    n_frames: int | None = None,
+) -> tuple[Any, tuple[int, ...], np.dtype]:
+    """
+    Start an ffmpeg process piping raw frames to stdout; returns the process, the shape of one frame and its dtype.
+
+    `start` (in seconds) drops all frames before it; decoding starts at the keyframe before `seek`, which defaults to `start` but should be earlier for open-GOP video. `n_frames` stops after that many frames.
+    """
+    if probe is None:
+        probe = _probe_video(path)
+    frame_shape, dtype = _frame_format(probe, pix_fmt=pix_fmt, crop=crop, size=size)
+
+    stream = ffmpeg.input(str(path))
+    if start is not None:
+        seek = start if seek is None else seek
+        # after seeking, timestamps count from the seek point
+        stream = ffmpeg.input(str(path), ss=seek).filter("select", f"gte(t,{start - seek})")
+    if every_n_frames > 1:
+        # drop frames in the decoder, so they are never converted and piped
+        stream = stream.filter("select", f"not(mod(n,{every_n_frames}))")
+    if crop is not None:
+        x, y, width, height = crop
+        stream = stream.filter("crop", width, height, x, y)
+    if size is not None:
+        stream = stream.filter("scale", *size)
+    output_args: dict[str, Any] = {} if n_frames is None else {"frames:v": n_frames}
+    process = (
+        stream
+        .output("pipe:", format="rawvideo", pix_fmt=pix_fmt, fps_mode="passthrough", **output_args)
+        .run_async(pipe_stdout=True)
+    )
+    return process, frame_shape, dtype
+
+
+def _open_segment(
+    path: Path | str,
+    probe: dict[str, Any],
+    keyframes: NDArray[np.float64],
+    first_frame: int,
+    n_frames: int | None = None,
+    **options: Any,
+) -> tuple[Any, tuple[int, ...], np.dtype]:
+    """
+    Like `_open_video`, but start at frame `first_frame` (frame exact, assuming a constant frame rate) and stop after `n_frames` output frames.
+
+    Decoding starts at the last keyframe *shown* before the frame we want. ffmpeg's own seek goes to the last keyframe
+    *decoded* before it, which for open-GOP video (B-frames that precede their keyframe) can be one too late.
+    """
+    # aim half a frame early, so rounding of timestamps can not make us skip the frame we want
+    start = max(first_frame - 0.5, 0) / _frame_rate(probe)
+    seek = keyframes[max(np.searchsorted(keyframes, start, side="right") - 1, 0)] if len(keyframes) else 0.0
+    return _open_video(path, probe=probe, start=start, seek=seek, n_frames=n_frames, **options)
+
+
+def _read_frames(stdout: IO[bytes], buffer: NDArray[Any]) -> int:
+    """Fill `buffer` with frames from an ffmpeg rawvideo pipe; returns the number of complete frames read."""
+    view = memoryview(buffer).cast("B")
+    filled = 0
+    while filled < len(view):
+        n = stdout.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled // (buffer[0].nbytes)
+
+
+def stream_video(
+    path: Path | str,
+    batch_size: int = 100,
+    reuse_buffers: int = 0,
+    every_n_frames: int = 1,
+    pix_fmt: str = "rgb24",
+    crop: tuple[int, int, int, int] | None = None,
+    size: tuple[int, int] | None = None,
+    prefetch: int = 0,
+    workers: int = 1,
+) -> Iterator[NDArray[Any]]:
     """
     Stream video frames from file using in batches to limit memory use.
 
     Decodes video via ffmpeg subprocess, yielding frames in fixed-size batches
-    to avoid loading entire video into RAM. Returns RGB frames as uint8 arrays.
+    to avoid loading entire video into RAM. Returns RGB frames as uint8 arrays by default.
+    Grayscale conversion, cropping and scaling are done by ffmpeg, so only the pixels you ask for go through the pipe.
+    Frames are read from the pipe straight into a preallocated batch array, without intermediate copies.
 
     Parameters
     ----------
@@ -35,73 +429,830 @@ def stream_video(path: Path | str, batch_size: int = 100) -> NDArray[Any]:
     batch_size : int, optional
         Number of frames per yielded batch. Tune based on available RAM and
         frame resolution (e.g., 1080p frames are ~6 MB each), by default 100.
+    reuse_buffers : int, optional
+        If > 0, cycle through this many preallocated batch buffers instead of allocating a new one for every batch. Saves allocations, but a yielded batch is overwritten `reuse_buffers` batches later, so copy anything you want to keep longer. By default 0 (every batch is a new array).
+    every_n_frames : int, optional
+        Only decode every n-th frame (frames 0, n, 2n, ...). Skipped frames are dropped inside ffmpeg, so they cost no conversion or pipe bandwidth. By default 1 (every frame).
+    pix_fmt : str, optional
+        Output pixel format: "rgb24" (uint8, 3 channels), "gray" (uint8) or "gray16le" (uint16), by default "rgb24".
+    crop : tuple[int, int, int, int] | None, optional
+        Region of interest (x, y, width, height) in pixels of the original video, by default None (full frame).
+    size : tuple[int, int] | None, optional
+        Scale frames (after cropping) to (width, height), by default None (no scaling).
+    prefetch : int, optional
+        If > 0, read batches in a background thread, keeping up to this many decoded batches ready, so decoding overlaps with whatever you do with the previous batch. With `reuse_buffers`, at least `prefetch + 2` buffers are used. By default 0 (read a batch only when it is asked for).
+    workers : int, optional
+        If > 1, split the video in segments of several batches and decode up to this many segments at the same time, in separate ffmpeg processes. Batches are still yielded in order, and are the same as with a single process as long as the video has a constant frame rate. Each segment is held in memory until it is yielded; `reuse_buffers` and `prefetch` do not apply. By default 1.
 
     Yields
     ------
     np.ndarray
-        Batch of frames with shape (N, H, W, 3) where N ≤ batch_size.
-        Dtype is uint8, channels are RGB. Final batch may be smaller.
+        Batch of frames with shape (N, H, W, 3) for rgb24 or (N, H, W) for the gray formats, where N ≤ batch_size.
+        H and W follow `crop` and `size`. Final batch may be smaller.
+
+    Notes
+    -----
+    Stopping early (breaking out of the loop, or closing the generator) stops ffmpeg and the prefetch thread.
     """
-    probe = ffmpeg.probe(path)
-    width = probe["streams"][0]["width"]
-    height = probe["streams"][0]["height"]
+    if workers > 1:
+        yield from _stream_segments(path, batch_size, workers, every_n_frames=every_n_frames, pix_fmt=pix_fmt, crop=crop, size=size)
+        return
+    process, frame_shape, dtype = _open_video(path, every_n_frames=every_n_frames, pix_fmt=pix_fmt, crop=crop, size=size)
+    if prefetch > 0 and reuse_buffers > 0:
+        # one buffer being read into, `prefetch` in the queue and one with the consumer
+        reuse_buffers = max(reuse_buffers, prefetch + 2)
+    batches = _read_batches(process.stdout, (batch_size, *frame_shape), dtype, reuse_buffers)
+    stop = threading.Event()
+    thread = None
+    try:
+        if prefetch > 0:
+            ready: queue.Queue[Any] = queue.Queue(maxsize=prefetch)
+            thread = threading.Thread(target=_prefetch, args=(batches, ready, stop), daemon=True)
+            thread.start()
+            while (batch := ready.get()) is not None:
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        else:
+            yield from batches
+    finally:
+        stop.set()
+        if process.poll() is None:
+            process.kill()  # consumer stopped early; this also unblocks a prefetch thread waiting on the pipe
+        if thread is not None:
+            thread.join()
+        process.stdout.close()
+        process.wait()
 
-    process = (
-        ffmpeg.input(path)
-        .output("pipe:", format="rawvideo", pix_fmt="rgb24")
-        .run_async(pipe_stdout=True)
-    )
 
-    frame_size = width * height * 3
+def _stream_segments(
+    path: Path | str, batch_size: int, workers: int, every_n_frames: int = 1, **options: Any
+) -> Iterator[NDArray[Any]]:
+    """Parallel decoding for `stream_video`: decode segments of whole batches concurrently, and yield their batches in order."""
+    probe = _probe_video(path)
+    frame_shape, dtype = _frame_format(probe, **options)
+    keyframes = _keyframe_times(path, probe)
+    expected = -(-_count_frames(probe) // every_n_frames)
+    # Every segment is decoded from the keyframe before it. Make segments a few keyframe intervals long, so that
+    # lead-in costs little, but short enough that all workers have something to do.
+    gop = np.median(np.diff(keyframes)) * _frame_rate(probe) if len(keyframes) > 1 else _count_frames(probe)
+    batches_per_segment = min(-(-4 * gop // (every_n_frames * batch_size)), -(-expected // (workers * batch_size)))
+    segment = max(int(batches_per_segment), 1) * batch_size
+    n_segments = max(-(-expected // segment), 1)
+
+    def decode(i: int) -> NDArray[Any]:
+        last = i == n_segments - 1
+        process, _, _ = _open_segment(
+            path, probe, keyframes, i * segment * every_n_frames, n_frames=None if last else segment,
+            every_n_frames=every_n_frames, **options,
+        )
+        try:
+            frames = np.empty((segment, *frame_shape), dtype=dtype)
+            if last:
+                # the probed frame count can be an estimate; read whatever is left
+                return _read_all(process.stdout, frames, batch_size=batch_size)
+            return frames[: _read_frames(process.stdout, frames)]
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    executor = ThreadPoolExecutor(workers)
+    try:
+        pending = [executor.submit(decode, i) for i in range(min(workers, n_segments))]
+        for i in range(n_segments):
+            frames = pending.pop(0).result()
+            if i + workers < n_segments:
+                pending.append(executor.submit(decode, i + workers))
+            for start in range(0, len(frames), batch_size):
+                yield frames[start : start + batch_size]
+            if len(frames) < segment:
+                break  # the video is shorter than probed
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _read_batches(
+    stdout: IO[bytes], shape: tuple[int, ...], dtype: np.dtype, reuse_buffers: int = 0
+) -> Iterator[NDArray[Any]]:
+    """Read batches of frames with `shape` from an ffmpeg rawvideo pipe, until the pipe runs dry."""
+    ring = [np.empty(shape, dtype=dtype) for _ in range(reuse_buffers)]
+    i = 0
+    while True:
+        buffer = ring[i % len(ring)] if ring else np.empty(shape, dtype=dtype)
+        i += 1
+        n_frames = _read_frames(stdout, buffer)
+        if n_frames == 0:
+            break
+
+        yield buffer[:n_frames]  # Process this chunk, then discard
+        if n_frames < shape[0]:
+            break
+
 
+def _read_all(stdout: IO[bytes], frames: NDArray[Any], filled: int = 0, batch_size: int = 100) -> NDArray[Any]:
+    """
+    Read an ffmpeg rawvideo pipe to the end into `frames`, starting at frame `filled`.
+
+    `frames` should own its data: it is resized in place if the pipe holds more frames than it has room for (a probed frame count can be an estimate), and shrunk to the frames actually read.
+    """
+    frame_shape = frames.shape[1:]
     while True:
-        batch = []
-        for _ in range(batch_size):
-            in_bytes = process.stdout.read(frame_size)
-            if not in_bytes:
-                break
-            frame = np.frombuffer(in_bytes, np.uint8).reshape([height, width, 3])
-            batch.append(frame)
-
-        if not batch:
+        if filled == len(frames):
+            frames.resize((filled + batch_size, *frame_shape), refcheck=False)
+        n_frames = _read_frames(stdout, frames[filled : filled + batch_size])
+        filled += n_frames
+        if n_frames == 0:
             break
+    if filled != len(frames):
+        frames.resize((filled, *frame_shape), refcheck=False)
+    return frames
 
-        yield np.array(batch)  # Process this chunk, then discard
 
-    process.wait()
+def _prefetch(batches: Iterator[Any], ready: queue.Queue[Any], stop: threading.Event) -> None:
+    """Move items from `batches` into the bounded queue `ready`, ending with None (or the exception that was raised)."""
+    try:
+        for batch in batches:
+            while not stop.is_set():
+                try:
+                    ready.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+        item = None
+    except BaseException as e:
+        item = e
+    while not stop.is_set():
+        try:
+            ready.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
 
 
-def load_video(path:Path|str, batch_size:int=100, every_n_frames:int=1,) -> NDArray[Any]:
+def decode_throughput(path: Path | str, **kwargs: Any) -> float:
+    """
+    Measure how fast `stream_video` decodes a video, in frames per second.
+
+    Streams the whole file without doing anything with the frames, so use it to compare options (batch size, buffer reuse, ...) on your own files and machine.
+
+    Parameters
+    ----------
+    path : Path | str
+        Path to video file.
+    **kwargs
+        Passed on to `stream_video`.
+
+    Returns
+    -------
+    float
+        Decoded frames per second.
+    """
+    start = time.perf_counter()
+    n_frames = sum(len(batch) for batch in stream_video(path, **kwargs))
+    return n_frames / (time.perf_counter() - start)
+
+
+def load_video(
+    path: Path | str,
+    batch_size: int = 100,
+    every_n_frames: int = 1,
+    pix_fmt: str = "rgb24",
+    crop: tuple[int, int, int, int] | None = None,
+    size: tuple[int, int] | None = None,
+    cache: bool = False,
+    workers: int = 1,
+) -> NDArray[Any]:
     """
     Load a video into a numpy array using ffmpeg. Load only every n frames to prevent memory explosion.
 
-    Load every n frames of a video file into a numpy array using ffmpeg; cut the video into batches, load these, only keep every n frames, and throw out the rest, and continue to the next batch. Use stream_video to manage batch-based loading.
+    Frames that are not kept are dropped by ffmpeg itself, so they are never converted or piped. The output array is allocated once from the frame count ffprobe reports, and frames are read from the pipe straight into it.
 
     Parameters
     ----------
     path : Path | str
         Path to video file (mp4, avi, mov, etc.). Any format readable by ffmpeg.
     batch_size : int, optional
-        Number of frames per yielded batch. Tune based on available RAM and
-        frame resolution (e.g., 1080p frames are ~6 MB each), by default 100.
+        Number of frames read from the pipe at once, by default 100.
     every_n_frames : int, optional
-        Keep every n frames, discard the rest to save memory, by default 1 (e.g., discard no frames).
+        Keep every n frames (frames 0, n, 2n, ...), discard the rest to save memory, by default 1 (e.g., discard no frames).
+    pix_fmt : str, optional
+        Output pixel format: "rgb24", "gray" or "gray16le", by default "rgb24". See `stream_video`.
+    crop : tuple[int, int, int, int] | None, optional
+        Region of interest (x, y, width, height), by default None (full frame).
+    size : tuple[int, int] | None, optional
+        Scale frames (after cropping) to (width, height), by default None (no scaling).
+    cache : bool, optional
+        Decode once to a .npy file in the video cache (see `configure_video_cache`), and return a copy-on-write `np.memmap` of it. Later calls with the same file (path, size, modification time) and options return the cached file without decoding. By default False.
+    workers : int, optional
+        Split the video in this many segments and decode them with concurrent ffmpeg processes. The result is the same as with a single process, as long as the video has a constant frame rate. By default 1.
 
     Returns
     -------
-    _type_
-        _description_
+    NDArray[Any]
+        Frames with shape (N, H, W, 3) for rgb24 or (N, H, W) for the gray formats.
     """
-    if batch_size % every_n_frames != 0:
-        warnings.warn(
-            "batch_size and every_n_frames are not attuned to each other; every_n_frames should fit into batch_size an integer number of times, or drift will occur between batches"
-        )
     if type(path) != Path:
         path = Path(path)
     if not path.exists():
         # ffmpeg is not good at saying it can't find a file, so do it for them
         raise FileNotFoundError(f"{path} does not exist.")
-    full_array = []
-    for batch in stream_video(path, batch_size=batch_size):
-        full_array.extend(batch[::every_n_frames])  # 
-    return np.array(full_array)
+    options = {"every_n_frames": every_n_frames, "pix_fmt": pix_fmt, "crop": crop, "size": size}
+    if cache:
+        return _cached_video(path, batch_size=batch_size, workers=workers, **options)
+    probe = _probe_video(path)
+    expected = -(-_count_frames(probe) // every_n_frames)
+    frame_shape, dtype = _frame_format(probe, pix_fmt=pix_fmt, crop=crop, size=size)
+    full_array = np.empty((expected, *frame_shape), dtype=dtype)
+    if workers > 1 and expected > workers:
+        return _load_segments(path, probe, full_array, workers, batch_size, **options)
+    process, _, _ = _open_video(path, probe=probe, **options)
+    try:
+        _read_all(process.stdout, full_array, batch_size=batch_size)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+    return full_array
+
+
+def _load_segments(
+    path: Path, probe: dict[str, Any], full_array: NDArray[Any], workers: int, batch_size: int, every_n_frames: int = 1, **options: Any
+) -> NDArray[Any]:
+    """Fill `full_array` with `workers` concurrently decoded segments; the last one is read to the end of the video."""
+    keyframes = _keyframe_times(path, probe)
+    bounds = np.linspace(0, len(full_array), workers + 1).astype(int)
+    processes = [
+        _open_segment(
+            path, probe, keyframes, first * every_n_frames, n_frames=None if i == workers - 1 else stop - first,
+            every_n_frames=every_n_frames, **options,
+        )[0]
+        for i, (first, stop) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            # reading the pipes releases the GIL, so threads are enough to keep all ffmpeg processes busy
+            n_read = list(executor.map(
+                lambda i: _read_frames(processes[i].stdout, full_array[bounds[i] : bounds[i + 1]]), range(workers)
+            ))
+        for i in range(workers - 1):
+            if n_read[i] < bounds[i + 1] - bounds[i] and any(n_read[i + 1 :]):
+                raise RuntimeError(f"segment {i} of {path} ended early; is the frame rate constant?")
+        short = next((i for i in range(workers) if n_read[i] < bounds[i + 1] - bounds[i]), None)
+        if short is not None:
+            # the video is shorter than probed
+            full_array.resize((bounds[short] + n_read[short], *full_array.shape[1:]), refcheck=False)
+        else:
+            # the video may be longer than probed
+            _read_all(processes[-1].stdout, full_array, filled=len(full_array), batch_size=batch_size)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+    return full_array
+
+
+# input pixel format for frames written to ffmpeg, by number of channels
+_WRITE_PIX_FMTS = {1: "gray", 3: "rgb24", 4: "rgba"}
+
+
+class VideoWriter:
+    """
+    Write frames to a video file through an ffmpeg stdin pipe, batch by batch; the counterpart of `stream_video`.
+
+    Frames can be of any dtype; they are converted to uint8 a batch at a time, optionally with `contrast_normalize`, and piped to ffmpeg as raw video, without intermediate files.
+
+    Parameters
+    ----------
+    path : Path | str
+        Output file; the container follows from the extension (mp4, mkv, avi, ...). Overwritten if it exists.
+    fps : float, optional
+        Frame rate of the output, by default 25.
+    codec : str, optional
+        ffmpeg video encoder, by default "libx264".
+    pix_fmt : str, optional
+        Pixel format of the encoded video, by default "yuv420p" (what most players expect).
+    normalize : bool, optional
+        Stretch the contrast of every batch to 0-255 with `contrast_normalize` before converting to uint8, by default False. Otherwise values are rounded and clipped to 0-255.
+    **output_kwargs
+        Extra ffmpeg output options, e.g. ``crf=18``.
+
+    Examples
+    --------
+    >>> with VideoWriter("out.mp4", fps=30) as writer:
+    ...     for batch in stream_video("in.mp4", pix_fmt="gray"):
+    ...         writer.write(autocontrast(batch))
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        fps: float = 25,
+        codec: str = "libx264",
+        pix_fmt: str = "yuv420p",
+        normalize: bool = False,
+        **output_kwargs: Any,
+    ) -> None:
+        self.path = Path(path)
+        self.fps = fps
+        self.normalize = normalize
+        self._output_kwargs = {"vcodec": codec, "pix_fmt": pix_fmt, **output_kwargs}
+        self._process: Any = None
+        self.frame_shape: tuple[int, ...] | None = None
+        self.n_frames = 0
+
+    def __enter__(self) -> "VideoWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error (e.g. a BrokenPipeError from write) with ffmpeg's exit code
+            self._finish()
+
+    def write(self, frames: NDArray[Any]) -> None:
+        """Write a batch of frames with shape (N, H, W) or (N, H, W, 3 or 4); all batches must have the same frame shape."""
+        frames = np.asarray(frames)
+        if self.frame_shape is None:
+            self._open(frames.shape[1:])
+        if frames.shape[1:] != self.frame_shape:
+            raise ValueError(f"frames of shape {frames.shape[1:]} do not match earlier frames of shape {self.frame_shape}.")
+        if len(frames) == 0:
+            return
+        if self.normalize:
+            frames = contrast_normalize(frames, maxpx=255, dtype=np.uint8)
+        if frames.dtype != np.uint8:
+            if frames.dtype.kind == "f":
+                frames = np.rint(frames)  # round like _rescale, rather than truncate
+            frames = np.clip(frames, 0, 255).astype(np.uint8)
+        self._process.stdin.write(np.ascontiguousarray(frames).data)
+        self.n_frames += len(frames)
+
+    def close(self) -> None:
+        """Finish writing the video, and wait for ffmpeg to finish."""
+        returncode = self._finish()
+        if returncode:
+            raise RuntimeError(f"ffmpeg failed writing {self.path} (exit code {returncode}).")
+
+    def _finish(self) -> int | None:
+        """Close ffmpeg's input and wait for it; returns its exit code (None if it was not running)."""
+        if self._process is None:
+            return None
+        process, self._process = self._process, None
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg already exited; its exit code tells what went wrong
+        return process.wait()
+
+    def _open(self, frame_shape: tuple[int, ...]) -> None:
+        channels = frame_shape[2] if len(frame_shape) == 3 else 1
+        if len(frame_shape) not in (2, 3) or channels not in _WRITE_PIX_FMTS:
+            raise ValueError(f"frames should have shape (N, H, W) or (N, H, W, 3 or 4), not (N, {', '.join(map(str, frame_shape))}).")
+        self.frame_shape = frame_shape
+        height, width = frame_shape[:2]
+        stream = ffmpeg.input(
+            "pipe:", format="rawvideo", pix_fmt=_WRITE_PIX_FMTS[channels], s=f"{width}x{height}", framerate=self.fps
+        )
+        if height % 2 or width % 2:
+            # most encoders (and yuv420p) need even dimensions; pad with one black row/column
+            stream = stream.filter("pad", "ceil(iw/2)*2", "ceil(ih/2)*2")
+        self._process = (
+            stream.output(str(self.path), **self._output_kwargs)
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+        )
+
+
+def write_video(
+    path: Path | str,
+    frames: NDArray[Any] | Iterable[NDArray[Any]],
+    fps: float = 25,
+    batch_size: int = 100,
+    normalize: bool = False,
+    **kwargs: Any,
+) -> int:
+    """
+    Write a stack of frames to a video file with ffmpeg, without intermediate image files.
+
+    Parameters
+    ----------
+    path : Path | str
+        Output file; the container follows from the extension. Overwritten if it exists.
+    frames : NDArray[Any] | Iterable[NDArray[Any]]
+        Frames as one (N, H, W[, 3 or 4]) array (of any dtype, e.g. a memmap), or as an iterable of such batches (e.g. from `stream_video`).
+    fps : float, optional
+        Frame rate of the output, by default 25.
+    batch_size : int, optional
+        Number of frames converted and written at once, if `frames` is a single array, by default 100.
+    normalize : bool, optional
+        Stretch the contrast of every batch with `contrast_normalize` before converting to uint8, by default False (clip to 0-255).
+    **kwargs
+        Passed on to `VideoWriter` (codec, pix_fmt, ffmpeg output options).
+
+    Returns
+    -------
+    int
+        Number of frames written.
+    """
+    if isinstance(frames, np.ndarray):
+        stack = frames
+        batches: Iterable[NDArray[Any]] = (stack[i : i + batch_size] for i in range(0, len(stack), batch_size))
+    else:
+        batches = frames
+    with VideoWriter(path, fps=fps, normalize=normalize, **kwargs) as writer:
+        for batch in batches:
+            writer.write(batch)
+    return writer.n_frames
+
+
+def stream_tiff(
+    path: Path | str,
+    batch_size: int = 100,
+    every_n_frames: int = 1,
+    axis: str | None = None,
+    select: dict[str, int] | None = None,
+    series: int = 0,
+) -> Iterator[NDArray[Any]]:
+    """
+    Stream frames from a (multi-page, OME, ImageJ or BigTIFF) TIFF stack in batches, like `stream_video` does for videos.
+
+    If the image data is stored contiguously and uncompressed, the file is memory-mapped and batches are views into it, so nothing is read until you use it. Otherwise the selected pages are read from the file, one batch at a time.
+
+    Parameters
+    ----------
+    path : Path | str
+        Path to TIFF file.
+    batch_size : int, optional
+        Number of frames per yielded batch, by default 100.
+    every_n_frames : int, optional
+        Only read every n-th frame (frames 0, n, 2n, ...), by default 1 (every frame).
+    axis : str | None, optional
+        Axis of the stack to stream frames along, as a tifffile axis letter (e.g. "T", "Z", or "Q" for plain multi-page files), by default None (the first axis).
+    select : dict[str, int] | None, optional
+        Index to take along every other stack axis, e.g. ``{"Z": 3, "C": 0}`` to stream channel 0 of slice 3 over time, by default None (there should be no other axes).
+    series : int, optional
+        Which image series in the file to read, by default 0.
+
+    Yields
+    ------
+    np.ndarray
+        Batch of frames with shape (N, H, W) or (N, H, W, S) for RGB(A) pages, where N ≤ batch_size. Final batch may be smaller.
+    """
+    with tifffile.TiffFile(path) as tif:
+        stack = _TiffStack(tif, series, axis, select)
+        frames = np.arange(0, stack.n_frames, every_n_frames)
+        data = stack.memmap(path, every_n_frames)
+        for start in range(0, len(frames), batch_size):
+            if data is not None:
+                yield data[start : start + batch_size]
+            else:
+                yield stack.read(frames[start : start + batch_size])
+
+
+def load_tiff(
+    path: Path | str,
+    every_n_frames: int = 1,
+    axis: str | None = None,
+    select: dict[str, int] | None = None,
+    series: int = 0,
+    memmap: bool = True,
+) -> NDArray[Any]:
+    """
+    Load frames from a (multi-page, OME, ImageJ or BigTIFF) TIFF stack into an array shaped like `load_video` output.
+
+    Parameters
+    ----------
+    path : Path | str
+        Path to TIFF file.
+    every_n_frames : int, optional
+        Keep every n frames (frames 0, n, 2n, ...), by default 1 (every frame).
+    axis : str | None, optional
+        Stack axis to use as frames, by default None (the first axis). See `stream_tiff`.
+    select : dict[str, int] | None, optional
+        Index to take along every other stack axis, by default None. See `stream_tiff`.
+    series : int, optional
+        Which image series in the file to read, by default 0.
+    memmap : bool, optional
+        If the image data is stored contiguously and uncompressed, return a read-only memory-mapped view of the file instead of reading it, so stacks larger than memory can be used. By default True.
+
+    Returns
+    -------
+    NDArray[Any]
+        Frames with shape (N, H, W) or (N, H, W, S) for RGB(A) pages.
+    """
+    with tifffile.TiffFile(path) as tif:
+        stack = _TiffStack(tif, series, axis, select)
+        data = stack.memmap(path, every_n_frames) if memmap else None
+        if data is not None:
+            return data
+        return stack.read(np.arange(0, stack.n_frames, every_n_frames))
+
+
+class _TiffStack:
+    """Maps frames along one axis of a TIFF series (with the other stack axes fixed) to pages."""
+
+    def __init__(self, tif: tifffile.TiffFile, series: int, axis: str | None, select: dict[str, int] | None) -> None:
+        self.tif = tif
+        self.series = tif.series[series]
+        self.index = series
+        page_axes = self.series.keyframe.axes
+        if not self.series.axes.endswith(page_axes):
+            raise ValueError(f"can not split series with axes {self.series.axes} into pages with axes {page_axes}.")
+        self.stack_axes = self.series.axes[: len(self.series.axes) - len(page_axes)]
+        self.stack_shape = self.series.shape[: len(self.stack_axes)]
+        self.page_axes = page_axes
+        if not self.stack_axes:
+            # a single image; treat as a stack of one
+            self.axis, self.select, self.n_frames = None, {}, 1
+            return
+        self.axis = self.stack_axes[0] if axis is None else axis
+        self.select = {} if select is None else dict(select)
+        if self.axis not in self.stack_axes:
+            raise ValueError(f"axis {self.axis!r} is not one of the stack axes {self.stack_axes!r}.")
+        unknown = set(self.select) - set(self.stack_axes) | ({self.axis} & set(self.select))
+        if unknown:
+            raise ValueError(f"can not select along {sorted(unknown)}; other stack axes are {self.stack_axes!r}.")
+        missing = [a for a in self.stack_axes if a != self.axis and a not in self.select]
+        if missing:
+            raise ValueError(f"stack has axes {self.stack_axes!r}; pass an index for {missing} in `select`.")
+        self.n_frames = self.stack_shape[self.stack_axes.index(self.axis)]
+
+    def pages(self, frames: NDArray[np.intp]) -> NDArray[np.intp]:
+        """Page indices (within the series) of frames."""
+        if self.axis is None:
+            return frames
+        index = [frames if a == self.axis else np.full_like(frames, self.select[a]) for a in self.stack_axes]
+        return np.ravel_multi_index(index, self.stack_shape)
+
+    def read(self, frames: NDArray[np.intp]) -> NDArray[Any]:
+        """Read frames from their pages, into a new (N, H, W[, S]) array."""
+        out = np.empty((len(frames), *self.series.keyframe.shape), dtype=self.series.dtype)
+        if len(frames) == 1:
+            self.tif.asarray(series=self.index, key=int(self.pages(frames)[0]), out=out[0])
+        elif len(frames):
+            self.tif.asarray(series=self.index, key=self.pages(frames).tolist(), out=out)
+        return self._channels_last(out)
+
+    def memmap(self, path: Path | str, every_n_frames: int) -> NDArray[Any] | None:
+        """A memory-mapped view of every n-th frame, or None if the data can not be memory-mapped."""
+        if self.series.dataoffset is None:
+            return None
+        try:
+            data = tifffile.memmap(path, series=self.index, mode="r")
+        except ValueError:
+            return None
+        if self.axis is None:
+            return self._channels_last(data[np.newaxis])
+        index = tuple(slice(None, None, every_n_frames) if a == self.axis else self.select[a] for a in self.stack_axes)
+        return self._channels_last(data[index])
+
+    def _channels_last(self, frames: NDArray[Any]) -> NDArray[Any]:
+        # pages with separate colour planes (SYX) are returned like chunky ones (YXS)
+        if "S" in self.page_axes and self.page_axes[-1] != "S":
+            return np.moveaxis(frames, 1 + self.page_axes.index("S"), -1)
+        return frames
+
+
+_video_cache: dict[str, Any] = {
+    "directory": Path(os.environ.get("PJMSTOOLS_CACHE_DIR", Path.home() / ".cache" / "pjmstools")) / "video",
+    "max_bytes": 50 * 2**30,
+}
+# room reserved for the .npy header, so frames can be written before their number is known
+_NPY_HEADER_BYTES = 128
+
+
+def configure_video_cache(directory: Path | str | None = None, max_bytes: int | None = None) -> None:
+    """
+    Configure the on-disk cache used by `load_video(..., cache=True)`.
+
+    Parameters
+    ----------
+    directory : Path | str | None, optional
+        Directory to keep decoded videos in, by default unchanged. Initially $PJMSTOOLS_CACHE_DIR/video, or ~/.cache/pjmstools/video.
+    max_bytes : int | None, optional
+        Total size of the cache; least recently used videos are removed when it grows beyond this, by default unchanged. Initially 50 GiB.
+    """
+    if directory is not None:
+        _video_cache["directory"] = Path(directory)
+    if max_bytes is not None:
+        _video_cache["max_bytes"] = max_bytes
+
+
+def clear_video_cache() -> None:
+    """Remove all decoded videos from the cache."""
+    for file in Path(_video_cache["directory"]).glob("*.npy"):
+        file.unlink(missing_ok=True)
+
+
+def _cached_video(path: Path, batch_size: int, workers: int = 1, **options: Any) -> np.memmap:
+    """Memory-map a decoded video from the cache, decoding it into the cache first if needed."""
+    directory = Path(_video_cache["directory"])
+    stat = path.stat()
+    key = repr((str(path.resolve()), stat.st_size, stat.st_mtime_ns, sorted(options.items())))
+    file = directory / f"{hashlib.sha1(key.encode()).hexdigest()}.npy"
+    if file.exists():
+        os.utime(file)  # mark as recently used
+        return np.load(file, mmap_mode="c")
+
+    directory.mkdir(parents=True, exist_ok=True)
+    frame_shape, dtype = _frame_format(_probe_video(path), pix_fmt=options["pix_fmt"], crop=options["crop"], size=options["size"])
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.seek(_NPY_HEADER_BYTES)
+            n_frames = 0
+            for batch in stream_video(path, batch_size=batch_size, reuse_buffers=1, workers=workers, **options):
+                f.write(batch.data)
+                n_frames += len(batch)
+            f.seek(0)
+            f.write(_npy_header(dtype, (n_frames, *frame_shape)))
+        os.replace(tmp, file)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    _evict_video_cache(keep=file)
+    return np.load(file, mmap_mode="c")
+
+
+def _npy_header(dtype: np.dtype, shape: tuple[int, ...]) -> bytes:
+    """A version 1.0 .npy header of exactly `_NPY_HEADER_BYTES` bytes."""
+    header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape})
+    header_len = _NPY_HEADER_BYTES - 10  # magic string, version and header length take 10 bytes
+    if len(header) >= header_len:
+        raise ValueError(f"shape {shape} does not fit in a {_NPY_HEADER_BYTES} byte .npy header.")
+    return b"\x93NUMPY\x01\x00" + header_len.to_bytes(2, "little") + header.ljust(header_len - 1).encode("latin1") + b"\n"
+
+
+def _evict_video_cache(keep: Path) -> None:
+    """Remove least recently used videos from the cache until it fits in its size cap (never removes `keep`)."""
+    files = sorted(Path(_video_cache["directory"]).glob("*.npy"), key=lambda file: file.stat().st_mtime)
+    total = sum(file.stat().st_size for file in files)
+    for file in files:
+        if total <= _video_cache["max_bytes"]:
+            break
+        if file == keep:
+            continue
+        total -= file.stat().st_size
+        file.unlink(missing_ok=True)
+
+
+class VideoReader:
+    """
+    Random access to the frames of a video, as if it were a (lazy) numpy array.
+
+    Frames are decoded in batches of `batch_size` through the same ffmpeg pipe as `stream_video`. To get to a batch, ffmpeg seeks to the nearest keyframe before it, so jumping to frame 50 000 does not decode the 50 000 frames before it. Recently decoded batches are kept in an LRU cache, so going back and forth over the same stretch of video is cheap.
+
+    Seeking converts frame numbers to timestamps, so this assumes a constant frame rate.
+
+    Parameters
+    ----------
+    path : Path | str
+        Path to video file (mp4, avi, mov, etc.). Any format readable by ffmpeg.
+    batch_size : int, optional
+        Number of frames decoded (and cached) together, by default 100.
+    max_cache_bytes : int, optional
+        Memory cap for the cache of decoded batches, by default 1 GiB. Least recently used batches are dropped first.
+    pix_fmt, crop, size : optional
+        Output format, region of interest and scaling, see `stream_video`.
+
+    Examples
+    --------
+    >>> video = VideoReader("recording.mp4")
+    >>> len(video)
+    72000
+    >>> video[50_000].shape
+    (1080, 1920, 3)
+    >>> video[1000:2000:10].shape
+    (100, 1080, 1920, 3)
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        batch_size: int = 100,
+        max_cache_bytes: int = 2**30,
+        pix_fmt: str = "rgb24",
+        crop: tuple[int, int, int, int] | None = None,
+        size: tuple[int, int] | None = None,
+    ) -> None:
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"{self.path} does not exist.")
+        self.batch_size = batch_size
+        self.max_cache_bytes = max_cache_bytes
+        self._options: dict[str, Any] = {"pix_fmt": pix_fmt, "crop": crop, "size": size}
+        self._probe = _probe_video(self.path)
+        self.fps = _frame_rate(self._probe)
+        self._n_frames = _count_frames(self._probe)
+        self.frame_shape, self.dtype = _frame_format(self._probe, **self._options)
+        self._keyframes: NDArray[np.float64] | None = None
+        self._cache: OrderedDict[int, NDArray[Any]] = OrderedDict()
+        self._cache_bytes = 0
+
+    def __len__(self) -> int:
+        return self._n_frames
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return (len(self), *self.frame_shape)
+
+    def __getitem__(self, key: int | slice) -> NDArray[Any]:
+        if isinstance(key, slice):
+            indices = range(*key.indices(len(self)))
+            out = np.empty((len(indices), *self.frame_shape), dtype=self.dtype)
+            if len(indices) == 0:
+                return out
+            first, last = sorted((indices[0] // self.batch_size, indices[-1] // self.batch_size))
+            span_bytes = (last + 1 - first) * self.batch_size * np.prod(self.frame_shape) * self.dtype.itemsize
+            if abs(indices.step) < self.batch_size and span_bytes <= self.max_cache_bytes:
+                # every batch in the span is needed: decode the missing ones with as few seeks as possible
+                self._load_batches(first, last + 1)
+            frames = np.asarray(indices)
+            batches = frames // self.batch_size
+            for batch_index in np.unique(batches):
+                mask = batches == batch_index
+                batch = self._get_batch(batch_index)
+                offsets = frames[mask] - batch_index * self.batch_size
+                if offsets.max() >= len(batch):
+                    raise IndexError(f"{self.path} has fewer frames than the {len(self)} it reports.")
+                out[mask] = batch[offsets]
+            return out
+        index = int(key)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"frame {key} out of range for a video of {len(self)} frames.")
+        batch_index, offset = divmod(index, self.batch_size)
+        batch = self._get_batch(batch_index)
+        if offset >= len(batch):
+            raise IndexError(f"{self.path} has fewer frames than the {len(self)} it reports.")
+        return batch[offset]
+
+    @property
+    def keyframes(self) -> NDArray[np.float64]:
+        """Sorted presentation times (in seconds, from the start of the video) of all keyframes. Only reads packet headers, no decoding."""
+        if self._keyframes is None:
+            self._keyframes = _keyframe_times(self.path, self._probe)
+        return self._keyframes
+
+    def clear_cache(self) -> None:
+        """Drop all cached batches."""
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def _get_batch(self, batch_index: int) -> NDArray[Any]:
+        if batch_index not in self._cache:
+            self._load_batches(batch_index, batch_index + 1)
+        if batch_index in self._cache:
+            self._cache.move_to_end(batch_index)
+            return self._cache[batch_index]
+        # batch does not fit in the cache at all; decode it without keeping it
+        return self._decode(batch_index, 1)
+
+    def _load_batches(self, first: int, stop: int) -> None:
+        """Make sure batches `first` up to `stop` are cached, decoding each run of missing batches in one go."""
+        batch_index = first
+        while batch_index < stop:
+            if batch_index in self._cache:
+                self._cache.move_to_end(batch_index)
+                batch_index += 1
+                continue
+            run_stop = batch_index
+            while run_stop < stop and run_stop not in self._cache:
+                run_stop += 1
+            frames = self._decode(batch_index, run_stop - batch_index)
+            for i in range(batch_index, run_stop):
+                start = (i - batch_index) * self.batch_size
+                self._add_to_cache(i, frames[start : start + self.batch_size].copy())
+            batch_index = run_stop
+
+    def _decode(self, batch_index: int, n_batches: int) -> NDArray[Any]:
+        """Decode `n_batches` consecutive batches, starting at `batch_index`."""
+        first_frame = batch_index * self.batch_size
+        n_frames = n_batches * self.batch_size
+        process, _, _ = _open_segment(self.path, self._probe, self.keyframes, first_frame, n_frames, **self._options)
+        try:
+            frames = np.empty((n_frames, *self.frame_shape), dtype=self.dtype)
+            return frames[: _read_frames(process.stdout, frames)]
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+    def _add_to_cache(self, batch_index: int, batch: NDArray[Any]) -> None:
+        if batch.nbytes > self.max_cache_bytes:
+            return
+        self._cache[batch_index] = batch
+        self._cache_bytes += batch.nbytes
+        while self._cache_bytes > self.max_cache_bytes:
+            _, dropped = self._cache.popitem(last=False)
+            self._cache_bytes -= dropped.nbytes
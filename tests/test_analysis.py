@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+import scipy.ndimage
+
+import pjmstools
+
+
+def _reference_kymograph(data, p1, p2, x_dim, y_dim, kymo_dim, n_points=100, order=1, mode="nearest"):
+    """Kymograph from one map_coordinates call over the full coordinate grid."""
+    other_dims = [d for d in range(data.ndim) if d not in (x_dim, y_dim, kymo_dim)]
+    grids = np.meshgrid(
+        np.arange(data.shape[kymo_dim]),
+        np.arange(n_points),
+        *[np.arange(data.shape[d]) for d in other_dims],
+        indexing="ij",
+    )
+    coords = np.zeros((data.ndim, *grids[0].shape))
+    coords[x_dim] = np.linspace(p1[0], p2[0], n_points)[grids[1]]
+    coords[y_dim] = np.linspace(p1[1], p2[1], n_points)[grids[1]]
+    coords[kymo_dim] = grids[0]
+    for i, d in enumerate(other_dims):
+        coords[d] = grids[2 + i]
+    return scipy.ndimage.map_coordinates(data, coords, order=order, mode=mode)
+
+
+@pytest.fixture(scope="module")
+def stack() -> np.ndarray:
+    # (t, c, y, x)
+    return np.random.default_rng(0).normal(size=(11, 2, 24, 30))
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+@pytest.mark.parametrize("chunk_size", [None, 1, 4, 100])
+@pytest.mark.parametrize(("p1", "p2"), [((2, 3), (25, 20)), ((0, 5), (29, 5))])
+def test_generate_kymograph_chunked(stack, order: int, chunk_size, p1, p2) -> None:
+    kymo = pjmstools.image.generate_kymograph(
+        stack, p1, p2, x_dim=3, y_dim=2, kymo_dim=0, n_points=37, order=order, chunk_size=chunk_size
+    )
+    reference = _reference_kymograph(stack, p1, p2, x_dim=3, y_dim=2, kymo_dim=0, n_points=37, order=order)
+    assert kymo.shape == (11, 37, 2)
+    if order <= 1:
+        assert np.array_equal(kymo, reference)
+    else:
+        # spline prefiltering per chunk only differs in rounding
+        assert np.allclose(kymo, reference, rtol=0, atol=1e-12)
+
+
+def test_generate_kymograph_axes(stack) -> None:
+    # kymograph along the channel axis, with time as "other" dimension
+    kymo = pjmstools.image.generate_kymograph(stack, (1, 1), (20, 9), x_dim=3, y_dim=2, kymo_dim=1, n_points=15, chunk_size=1)
+    reference = _reference_kymograph(stack, (1, 1), (20, 9), x_dim=3, y_dim=2, kymo_dim=1, n_points=15)
+    assert np.array_equal(kymo, reference)
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+@pytest.mark.parametrize("mode", ["nearest", "constant", "reflect", "wrap"])
+def test_kymograph_plan(stack, order: int, mode: str) -> None:
+    # (t, y, x, c) frames, with the line partly outside the frame
+    frames = np.moveaxis(stack, 1, -1)
+    plan = pjmstools.image.KymographPlan((-2.5, 3), (31, 20.2), frame_shape=frames.shape[1:3], n_points=41, order=order, mode=mode)
+    reference = pjmstools.image.generate_kymograph(frames, (-2.5, 3), (31, 20.2), 2, 1, 0, n_points=41, order=order, mode=mode)
+    assert np.allclose(plan.apply(frames), reference, rtol=0, atol=1e-10)
+    # the matrix is sparse: (order + 1)**2 pixels per point at most
+    assert plan.matrix.nnz <= 41 * (order + 1) ** 2
+
+
+def test_kymograph_plan_serialise(tmp_path, stack) -> None:
+    import pickle
+
+    frames = stack[:, 0]
+    plan = pjmstools.image.KymographPlan((1, 2), (25, 20), frame_shape=frames.shape[1:], n_points=30, order=3)
+    plan.save(tmp_path / "plan.npz")
+    for restored in [pjmstools.image.KymographPlan.load(tmp_path / "plan.npz"), pickle.loads(pickle.dumps(plan))]:
+        assert np.array_equal(restored.apply(frames), plan.apply(frames))
+    with pytest.raises(ValueError):
+        plan.apply(stack[:, :, :10])
+
+
+def test_generate_kymographs_segments(stack) -> None:
+    lines = [[(2, 3), (25, 20)], [(0, 5), (29, 5)], [(10, 23), (10, 0)]]
+    kymos = pjmstools.image.generate_kymographs(stack, lines, x_dim=3, y_dim=2, kymo_dim=0, n_points=37, chunk_size=4, workers=2)
+    assert kymos.shape == (3, 11, 37, 2)
+    for (p1, p2), kymo in zip(lines, kymos):
+        assert np.array_equal(kymo, pjmstools.image.generate_kymograph(stack, p1, p2, 3, 2, 0, n_points=37))
+
+
+def test_generate_kymographs_polyline_width() -> None:
+    # stripes along x: a horizontal line with width 3 averages rows 4, 5 and 6
+    data = np.repeat(np.arange(12.0)[None, :, None] ** 2, 20, axis=2).repeat(3, axis=0)
+    kymo = pjmstools.image.generate_kymographs(data, [[(2, 5), (15, 5)]], x_dim=2, y_dim=1, kymo_dim=0, n_points=14, linewidth=3)
+    assert np.allclose(kymo, (16 + 25 + 36) / 3)
+
+    # a polyline of two segments samples both, evenly spread over its length
+    data = np.random.default_rng(1).normal(size=(2, 30, 30))
+    polyline = [(1, 1), (21, 1), (21, 11)]
+    kymo = pjmstools.image.generate_kymographs(data, [polyline], x_dim=2, y_dim=1, kymo_dim=0, n_points=31)[0]
+    first = pjmstools.image.generate_kymograph(data, (1, 1), (21, 1), 2, 1, 0, n_points=21)
+    second = pjmstools.image.generate_kymograph(data, (21, 1), (21, 11), 2, 1, 0, n_points=11)
+    assert np.allclose(kymo, np.concatenate([first, second[:, 1:]], axis=1))
+    with pytest.raises(ValueError):
+        pjmstools.image.generate_kymographs(data, [[(1, 1)]], x_dim=2, y_dim=1, kymo_dim=0)
+
+
+@pytest.mark.parametrize("order", [1, 3])
+@pytest.mark.parametrize("n_frames", [None, 5, 11])
+def test_stream_kymograph(stack, order: int, n_frames) -> None:
+    frames = np.moveaxis(stack, 1, -1)  # (t, y, x, c)
+    batches = (frames[i : i + 3] for i in range(0, len(frames), 3))
+    kymo = pjmstools.image.stream_kymograph(batches, (2, 3), (25, 20), n_points=37, order=order, n_frames=n_frames)
+    reference = pjmstools.image.generate_kymograph(frames, (2, 3), (25, 20), 2, 1, 0, n_points=37, order=order)
+    assert kymo.shape == (11, 37, 2)
+    assert np.allclose(kymo, reference, rtol=0, atol=1e-10)
+
+
+def test_kymograph_builder_plan(stack) -> None:
+    frames = stack[:, 0]
+    plan = pjmstools.image.KymographPlan((1, 2), (25, 20), frame_shape=frames.shape[1:], n_points=30)
+    builder = pjmstools.image.KymographBuilder(plan=plan)
+    with pytest.raises(ValueError):
+        builder.kymograph
+    for batch in np.array_split(frames, 4):
+        builder.update(batch)
+    assert np.allclose(builder.kymograph, plan.apply(frames))
+    with pytest.raises(ValueError):
+        pjmstools.image.KymographBuilder((1, 2))
+
+
+def test_kymograph_builder_growth_keeps_views(stack) -> None:
+    frames = stack[:, 0]
+    builder = pjmstools.image.KymographBuilder((1, 2), (25, 20), n_points=30, n_frames=2)
+    builder.update(frames[:2])
+    early = builder.kymograph
+    expected = early.copy()
+    for batch in np.array_split(frames[2:], 3):
+        builder.update(batch)
+    assert np.array_equal(early, expected)
+    kymo = builder.finish()
+    assert kymo.base is None or kymo.base.shape[0] == len(frames)
+    assert kymo.shape == (len(frames), 30)
+    assert np.allclose(kymo[:2], expected)
@@ -1,3 +1,4 @@
+import warnings
 import pytest
 import pjmstools
 import numpy as np
@@ -35,3 +36,231 @@ def test_transform_coordinate_system() -> None:
     ax.plot((start[0],end[0]),(start[1],end[1]), color="black")
     ax.scatter(tests[:,0],tests[:,1],c="red")
     ax.scatter(start_ed[:,0], start_ed[:,1],c="green")
+
+def test_auto_correlate_matches_pandas() -> None:
+    import pandas as pd
+    rng = np.random.default_rng(42)
+    data = np.cumsum(rng.normal(size=300)) + 50
+    series = pd.Series(data)
+    expected = [series.autocorr(lag=lag) for lag in range(len(data) - 1)]
+    assert np.allclose(pjmstools.auto_correlate(data), expected, atol=1e-9)
+
+def test_auto_correlate_with_nans_matches_pandas() -> None:
+    import pandas as pd
+    rng = np.random.default_rng(43)
+    data = np.cumsum(rng.normal(size=50)) + 50
+    data[[3, 20, 21, 45]] = np.nan
+    series = pd.Series(data)
+    expected = [series.autocorr(lag=lag) for lag in range(len(data) - 1)]
+    result = pjmstools.auto_correlate(data)
+    assert np.allclose(result, expected, atol=1e-9, equal_nan=True)
+    assert not np.isnan(result[:40]).any()
+    # every series along the axis has its own NaNs
+    stack = np.stack([data, data[::-1]])
+    assert np.allclose(pjmstools.auto_correlate(stack)[1], pjmstools.auto_correlate(data[::-1]), equal_nan=True)
+
+def test_auto_correlate_batched() -> None:
+    rng = np.random.default_rng(1)
+    traces = rng.normal(size=(5, 200))
+    cor = pjmstools.auto_correlate(traces.T, max_lag=20, axis=0)
+    assert cor.shape == (21, 5)
+    for i, trace in enumerate(traces):
+        assert np.allclose(cor[:, i], pjmstools.auto_correlate(trace)[:21])
+    assert np.allclose(pjmstools.auto_correlate(traces[0], max_lag=0), [1.0])
+    with pytest.raises(ValueError):
+        pjmstools.auto_correlate(traces[0], max_lag=-5)
+
+def test_closest_in_list_first_wins() -> None:
+    l = [4, 1, 3, 1, 5]
+    assert pjmstools.closest_in_list(l, 2) == 1   # 1 and 3 equally close, 1 comes first
+    assert pjmstools.closest_in_list(l, 4.5) == 0
+    assert list(pjmstools.closest_in_list(l, [0, 3.2, 10])) == [1, 2, 4]
+    assert pjmstools.closest_key_in_a_dict(4.231, {1: "a", 5: "b", 4: "c"}) == (4, "c")
+
+def test_nearest_index_k_and_insert() -> None:
+    index = pjmstools.NearestIndex([10.0, 0.0])
+    index.insert([5.0, 0.0])
+    assert len(index) == 4
+    assert index.query(0.1) == 1
+    assert list(index.query(4.0, k=3)) == [2, 1, 3]
+    assert list(index.nearest([6.0, 11.0])) == [5.0, 10.0]
+    # ties across a run of equal values below the target go to the earliest positions
+    assert list(pjmstools.NearestIndex([1, 1, 1, 5]).query(1.1, k=2)) == [0, 1]
+    assert list(pjmstools.NearestIndex([1, 1, 1, 5]).query(4.0, k=3)) == [3, 0, 1]
+
+def test_closest_key_in_a_dict_many_targets() -> None:
+    d = {1: "a", 5: "b", 4: "c", 3: "d"}
+    index = pjmstools.NearestIndex(d)
+    assert pjmstools.closest_key_in_a_dict(2.0, d, index=index) == (1, "a")
+    assert pjmstools.closest_key_in_a_dict([0, 4.4, 10], d, index=index) == [(1, "a"), (4, "c"), (5, "b")]
+    assert pjmstools.closest_key_in_a_dict(np.array([4.6]), d) == [(5, "b")]
+
+def test_closest_key_in_a_dict_keeps_keys() -> None:
+    # the dict's own keys come back, not numpy's conversion of them
+    key, value = pjmstools.closest_key_in_a_dict(1.1, {1: "a", 2.5: "b"})
+    assert (key, value) == (1, "a") and type(key) is int
+    assert pjmstools.closest_key_in_a_dict(2.0**61, {2**60 + 1: "a", 0.5: "b"}) == (2**60 + 1, "a")
+    d = {0.5: "b", 3: "c"}
+    index = pjmstools.NearestIndex(d)
+    index.insert(7)
+    d[7] = "d"
+    assert pjmstools.closest_key_in_a_dict([0, 6], d, index=index) == [(0.5, "b"), (7, "d")]
+
+@pytest.mark.parametrize("N", [1, 2, 5, 40])
+def test_running_stats_match_pandas(N: int) -> None:
+    import pandas as pd
+    rng = np.random.default_rng(3)
+    data = rng.normal(size=300)
+    data[100] = np.nan
+    rolling = pd.DataFrame({"data": data}).rolling(N)
+    for ours, theirs in [
+        (pjmstools.running_average, rolling.mean()),
+        (pjmstools.running_std, rolling.std()),
+    ]:
+        expected = theirs.to_numpy()[:, 0]
+        assert np.allclose(ours(data, N, remove_nans=False), expected, equal_nan=True)
+        assert np.allclose(ours(data, N), expected[~np.isnan(expected)])
+
+@pytest.mark.parametrize("N", [3, 40])
+def test_running_stats_axis_dtype_and_offset(N: int) -> None:
+    rng = np.random.default_rng(4)
+    stack = rng.normal(size=(3, 200, 2)).astype(np.float32)
+    result = pjmstools.running_std(stack, N, axis=1)
+    assert result.dtype == np.float32
+    assert result.shape == (3, 200 - N + 1, 2)
+    assert np.allclose(result[1, :, 0], pjmstools.running_std(stack[1, :, 0], N))
+    # a large offset should not affect the std
+    trace = rng.normal(size=200)
+    assert np.allclose(
+        pjmstools.running_std(trace + 1e8, N), pjmstools.running_std(trace, N), atol=1e-7
+    )
+
+@pytest.mark.parametrize("N", [12, 25])
+def test_running_stats_non_finite_blocks(N: int) -> None:
+    import pandas as pd
+    rng = np.random.default_rng(12)
+    data = rng.normal(size=400) * 3 + 1e6
+    data[50:50 + N] = np.nan   # a whole chunk without a finite reference
+    data[3 * N] = np.inf       # first sample of a chunk
+    data[7 * N + 1] = np.nan
+    rolling = pd.Series(data).rolling(N)
+    assert np.allclose(pjmstools.running_average(data, N, remove_nans=False), rolling.mean(), equal_nan=True)
+    assert np.allclose(pjmstools.running_std(data, N, remove_nans=False), rolling.std(), equal_nan=True, atol=1e-6)
+    stats = pjmstools.RollingStats(N, remove_nans=False)
+    stds = np.concatenate([stats.update(data[i:i + 30])[1] for i in range(0, len(data), 30)])
+    assert np.array_equal(stds, pjmstools.running_std(data, N, remove_nans=False)[N - 1:], equal_nan=True)
+
+@pytest.mark.parametrize("N", [4, 40])
+def test_rolling_stats_chunked_matches_one_shot(N: int) -> None:
+    rng = np.random.default_rng(5)
+    frames = rng.normal(size=(500, 2, 3)) + 100
+    stats = pjmstools.RollingStats(N, axis=0)
+    means, stds = [], []
+    for start in range(0, len(frames), 37):
+        mean, std = stats.update(frames[start:start + 37])
+        means.append(mean)
+        stds.append(std)
+    assert np.array_equal(np.concatenate(means), pjmstools.running_average(frames, N, axis=0))
+    assert np.array_equal(np.concatenate(stds), pjmstools.running_std(frames, N, axis=0))
+    assert stats._tail.shape[0] <= 2 * N - 2
+
+@pytest.mark.parametrize("statistic", ["mean", "std", "median", "min", "max", "count", "sum"])
+def test_binned_statistic_dd_matches_scipy(statistic: str) -> None:
+    import scipy.stats
+    rng = np.random.default_rng(6)
+    sample = rng.normal(size=(1000, 2))
+    values = rng.normal(size=(2, 1000))
+    expected = scipy.stats.binned_statistic_dd(sample, values, statistic, bins=6)
+    result = pjmstools.binned_statistic_dd(sample, values, statistic, bins=6)
+    assert np.allclose(result.statistic, expected.statistic, equal_nan=True)
+    assert np.array_equal(result.binnumber, expected.binnumber)
+
+@pytest.mark.parametrize(
+    "statistic, func",
+    [
+        ("nanmean", np.nanmean),
+        ("nansum", np.nansum),
+        ("nanstd", np.nanstd),
+        ("nancount", lambda v: np.count_nonzero(~np.isnan(v))),
+    ],
+)
+def test_binned_statistic_dd_nan_statistics(statistic, func) -> None:
+    rng = np.random.default_rng(7)
+    sample = rng.normal(size=(500, 2))
+    values = rng.normal(size=500)
+    values[::4] = np.nan
+    values[np.argmin(sample[:, 0])] = np.nan
+    result = pjmstools.binned_statistic_dd(sample, values, statistic, bins=4)
+    binnumber = result.binnumber.reshape(1, -1)
+    for flat_bin in np.unique(binnumber):
+        idx = np.unravel_index(flat_bin, (6, 6))
+        with np.errstate(all="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            expected = func(values[binnumber[0] == flat_bin])
+        assert np.allclose(result.statistic[idx[0] - 1, idx[1] - 1], expected, equal_nan=True)
+
+def test_binning_plan_matches_binned_statistic_dd() -> None:
+    rng = np.random.default_rng(8)
+    sample = rng.normal(size=(800, 2))
+    values = rng.normal(size=(3, 800))
+    statistics = ["mean", "std", "median", "count", "max", np.ptp]
+    plan = pjmstools.BinningPlan(sample, bins=5)
+    results = plan.compute(values, statistics)
+    assert plan.count.sum() == 800
+    for statistic in statistics:
+        expected = pjmstools.binned_statistic_dd(sample, values, statistic, bins=5)
+        assert np.array_equal(results[statistic], expected.statistic, equal_nan=True)
+
+def test_binned_statistic_accumulator_chunks_and_merge() -> None:
+    import pickle
+    rng = np.random.default_rng(9)
+    sample = rng.random((3000, 2))
+    values = rng.normal(size=(2, 3000)) + 1e4
+    edges = [np.linspace(0, 1, 6), np.linspace(0, 1, 4)]
+    chunks = [(sample[i:i + 400], values[:, i:i + 400]) for i in range(0, 3000, 400)]
+    first = pjmstools.BinnedStatisticAccumulator(edges).consume(chunks[:4])
+    second = pjmstools.BinnedStatisticAccumulator(edges).consume(chunks[4:])
+    combined = first.merge(pickle.loads(pickle.dumps(second)))
+    assert combined.n_samples == 3000
+    for statistic in combined.statistics:
+        expected = pjmstools.binned_statistic_dd(sample, values, statistic, bins=edges)
+        assert np.allclose(combined.result(statistic), expected.statistic, equal_nan=True)
+
+def test_binned_statistic_accumulator_results_are_copies() -> None:
+    rng = np.random.default_rng(11)
+    sample = rng.random((500, 2))
+    values = rng.normal(size=500)
+    acc = pjmstools.BinnedStatisticAccumulator([np.linspace(0, 1, 4)] * 2).update(sample, values)
+    expected = {statistic: acc.result(statistic) for statistic in acc.statistics}
+    for statistic in acc.statistics:
+        acc.result(statistic)[:] = 0
+    for statistic in acc.statistics:
+        assert np.array_equal(acc.result(statistic), expected[statistic], equal_nan=True)
+
+@pytest.mark.parametrize("pool", ["thread", "process"])
+def test_binned_statistic_dd_callable_pool_matches_serial(pool: str) -> None:
+    import scipy.stats
+    rng = np.random.default_rng(10)
+    sample = rng.normal(size=(2000, 2))
+    values = rng.normal(size=2000)
+    serial = pjmstools.binned_statistic_dd(sample, values, np.ptp, bins=10)
+    expected = scipy.stats.binned_statistic_dd(sample, values, np.ptp, bins=10)
+    parallel = pjmstools.binned_statistic_dd(
+        sample, values, np.ptp, bins=10, workers=2, pool=pool
+    )
+    assert np.array_equal(serial.statistic, expected.statistic, equal_nan=True)
+    assert np.array_equal(parallel.statistic, serial.statistic, equal_nan=True)
+
+@pytest.mark.parametrize("method", ["linear", "lower", "nearest", "midpoint", "hazen"])
+def test_binned_statistic_dd_quantile(method: str) -> None:
+    rng = np.random.default_rng(11)
+    sample = rng.normal(size=(1500, 2))
+    values = rng.normal(size=1500)
+    q = [0.1, 0.5, 0.9]
+    result = pjmstools.binned_statistic_dd(sample, values, "quantile", bins=4, q=q, method=method)
+    assert result.statistic.shape == (3, 4, 4)
+    for i, quantile in enumerate(q):
+        expected = pjmstools.binned_statistic_dd(
+            sample, values, lambda v: np.quantile(v, quantile, method=method), bins=4
+        )
+        assert np.allclose(result.statistic[i], expected.statistic, equal_nan=True)
@@ -0,0 +1,432 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+import tifffile
+
+import pjmstools
+
+needs_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None,
+    reason="ffmpeg/ffprobe not installed",
+)
+
+N_FRAMES = 60
+WIDTH, HEIGHT = 64, 48
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    """Small lossless test video, so decoded frames are deterministic."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not installed")
+    path = tmp_path_factory.mktemp("video") / "test.mkv"
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-f", "lavfi",
+            "-i", f"testsrc=size={WIDTH}x{HEIGHT}:rate=25",
+            "-frames:v", str(N_FRAMES), "-c:v", "ffv1", "-pix_fmt", "rgb24", str(path),
+        ],
+        check=True,
+    )
+    return path
+
+
+def _all_frames(path) -> np.ndarray:
+    """Reference decode of all frames in one go."""
+    out = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(path), "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:"],
+        capture_output=True,
+        check=True,
+    ).stdout
+    return np.frombuffer(out, np.uint8).reshape(-1, HEIGHT, WIDTH, 3)
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("reuse_buffers", [0, 2])
+def test_stream_video_batches(video, reuse_buffers: int) -> None:
+    batches = [
+        batch.copy()
+        for batch in pjmstools.image.stream_video(video, batch_size=25, reuse_buffers=reuse_buffers)
+    ]
+    assert [len(batch) for batch in batches] == [25, 25, 10]
+    assert batches[0].dtype == np.uint8
+    assert np.array_equal(np.concatenate(batches), _all_frames(video))
+
+
+@needs_ffmpeg
+def test_decode_throughput(video) -> None:
+    assert pjmstools.image.decode_throughput(video, batch_size=16) > 0
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("every_n_frames", [1, 3, 7])
+def test_load_video_every_n_frames(video, every_n_frames: int) -> None:
+    frames = pjmstools.image.load_video(video, batch_size=16, every_n_frames=every_n_frames)
+    assert frames.dtype == np.uint8
+    assert np.array_equal(frames, _all_frames(video)[::every_n_frames])
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("n_probed", [0, 10, 1000])
+def test_load_video_wrong_frame_count(video, monkeypatch, n_probed: int) -> None:
+    # containers can under- or overstate the number of frames; the output must not depend on it
+    monkeypatch.setattr(pjmstools.image.image, "_count_frames", lambda probe: n_probed)
+    frames = pjmstools.image.load_video(video, batch_size=16, every_n_frames=2)
+    assert np.array_equal(frames, _all_frames(video)[::2])
+
+
+@needs_ffmpeg
+def test_stream_video_crop(video) -> None:
+    x, y, w, h = 5, 10, 32, 20
+    frames = np.concatenate(list(pjmstools.image.stream_video(video, batch_size=16, crop=(x, y, w, h))))
+    assert np.array_equal(frames, _all_frames(video)[:, y : y + h, x : x + w])
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize(
+    ("pix_fmt", "dtype"), [("rgb24", np.uint8), ("gray", np.uint8), ("gray16le", np.uint16)]
+)
+def test_load_video_formats(video, pix_fmt: str, dtype) -> None:
+    frames = pjmstools.image.load_video(video, every_n_frames=4, pix_fmt=pix_fmt, crop=(0, 0, 40, 30), size=(20, 16))
+    channels = (3,) if pix_fmt == "rgb24" else ()
+    assert frames.shape == (N_FRAMES // 4, 16, 20, *channels)
+    assert frames.dtype == dtype
+    # a gray test card should still have structure in it
+    assert frames.std() > 0
+
+
+@needs_ffmpeg
+def test_load_video_bad_options(video) -> None:
+    with pytest.raises(ValueError):
+        pjmstools.image.load_video(video, pix_fmt="yuv420p")
+    with pytest.raises(ValueError):
+        pjmstools.image.load_video(video, crop=(40, 0, 40, 10))
+
+
+@pytest.fixture(scope="module")
+def gop_video(tmp_path_factory):
+    """Test video with keyframes only every 12 frames and B-frames, so seeking has to decode from a keyframe."""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("ffmpeg not installed")
+    path = tmp_path_factory.mktemp("video") / "gop.mp4"
+    subprocess.run(
+        [
+            "ffmpeg", "-v", "error", "-f", "lavfi",
+            "-i", f"testsrc=size={WIDTH}x{HEIGHT}:rate=25",
+            "-frames:v", str(N_FRAMES), "-c:v", "mpeg4", "-g", "12", "-bf", "2", str(path),
+        ],
+        check=True,
+    )
+    return path
+
+
+@needs_ffmpeg
+def test_video_reader_random_access(gop_video) -> None:
+    reference = _all_frames(gop_video)
+    video = pjmstools.image.VideoReader(gop_video, batch_size=7)
+    assert len(video) == N_FRAMES
+    assert video.shape == reference.shape
+    for i in [0, 6, 7, 13, 37, 59, -1, -60, 20]:
+        assert np.array_equal(video[i], reference[i])
+    for key in [slice(None), slice(5, 40, 3), slice(50, 10, -4), slice(30, 30)]:
+        assert np.array_equal(video[key], reference[key])
+    with pytest.raises(IndexError):
+        video[N_FRAMES]
+
+
+@needs_ffmpeg
+def test_video_reader_sparse_slice(gop_video, monkeypatch) -> None:
+    video = pjmstools.image.VideoReader(gop_video, batch_size=5)
+    video[12]
+    decoded = []
+    decode = video._decode
+    monkeypatch.setattr(video, "_decode", lambda batch_index, n_batches: decoded.append(n_batches) or decode(batch_index, n_batches))
+    # a step of a batch or more only decodes the batches it needs, and keeps what was cached
+    assert np.array_equal(video[0:60:20], _all_frames(gop_video)[0:60:20])
+    assert decoded == [1, 1, 1]
+    assert 2 in video._cache
+
+
+@needs_ffmpeg
+def test_video_reader_cache_cap(gop_video) -> None:
+    frame_bytes = WIDTH * HEIGHT * 3
+    video = pjmstools.image.VideoReader(gop_video, batch_size=5, max_cache_bytes=12 * frame_bytes)
+    video[0:60:4]
+    assert video._cache_bytes <= 12 * frame_bytes
+    assert list(video._cache) == [10, 11]  # least recently used batches are dropped
+    # a cap smaller than a single batch still works, it just never caches
+    video = pjmstools.image.VideoReader(gop_video, batch_size=5, max_cache_bytes=frame_bytes, pix_fmt="gray")
+    assert np.array_equal(video[12], pjmstools.image.load_video(gop_video, pix_fmt="gray")[12])
+    assert not video._cache
+
+
+@pytest.fixture
+def video_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(pjmstools.image.image, "_video_cache", dict(pjmstools.image.image._video_cache))
+    pjmstools.image.configure_video_cache(directory=tmp_path / "cache")
+    return tmp_path / "cache"
+
+
+@needs_ffmpeg
+def test_load_video_cache(video, video_cache, monkeypatch) -> None:
+    frames = pjmstools.image.load_video(video, every_n_frames=2, pix_fmt="gray", cache=True)
+    assert isinstance(frames, np.memmap)
+    assert np.array_equal(frames, pjmstools.image.load_video(video, every_n_frames=2, pix_fmt="gray"))
+    assert len(list(video_cache.glob("*.npy"))) == 1
+
+    # a second call does not decode, and the cached file can not be changed through the result
+    monkeypatch.setattr(pjmstools.image.image, "stream_video", None)
+    cached = pjmstools.image.load_video(video, every_n_frames=2, pix_fmt="gray", cache=True)
+    cached[:] = 0
+    assert np.array_equal(pjmstools.image.load_video(video, every_n_frames=2, pix_fmt="gray", cache=True), frames)
+
+
+@needs_ffmpeg
+def test_load_video_cache_eviction(video, video_cache) -> None:
+    pjmstools.image.load_video(video, pix_fmt="gray", cache=True)
+    frames = pjmstools.image.load_video(video, pix_fmt="gray", crop=(0, 0, 32, 32), cache=True)
+    assert len(list(video_cache.glob("*.npy"))) == 2
+    pjmstools.image.configure_video_cache(max_bytes=frames.nbytes + 16 * 16 * N_FRAMES + 1000)
+    pjmstools.image.load_video(video, pix_fmt="gray", crop=(0, 0, 16, 16), cache=True)
+    # only the most recently used videos that fit in the cap are kept
+    assert len(list(video_cache.glob("*.npy"))) == 2
+    pjmstools.image.clear_video_cache()
+    assert not list(video_cache.glob("*.npy"))
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("reuse_buffers", [0, 1])
+def test_stream_video_prefetch(video, reuse_buffers: int) -> None:
+    batches = [
+        batch.copy()
+        for batch in pjmstools.image.stream_video(video, batch_size=8, prefetch=2, reuse_buffers=reuse_buffers)
+    ]
+    assert np.array_equal(np.concatenate(batches), _all_frames(video))
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_stream_video_close_stops_ffmpeg(video, monkeypatch, prefetch: int) -> None:
+    processes = []
+    open_video = pjmstools.image.image._open_video
+
+    def recording_open_video(*args, **kwargs):
+        processes.append(open_video(*args, **kwargs))
+        return processes[-1]
+
+    monkeypatch.setattr(pjmstools.image.image, "_open_video", recording_open_video)
+    for batch in pjmstools.image.stream_video(video, batch_size=2, prefetch=prefetch):
+        break
+    process = processes[0][0]
+    assert process.poll() is not None
+
+
+@needs_ffmpeg
+def test_stream_video_prefetch_error(video, monkeypatch) -> None:
+    read_frames = pjmstools.image.image._read_frames
+    calls = []
+
+    def failing_read_frames(stdout, buffer):
+        calls.append(None)
+        if len(calls) > 2:
+            raise RuntimeError("broken pipe")
+        return read_frames(stdout, buffer)
+
+    monkeypatch.setattr(pjmstools.image.image, "_read_frames", failing_read_frames)
+    batches = pjmstools.image.stream_video(video, batch_size=8, prefetch=4)
+    assert len(next(batches)) == 8
+    assert len(next(batches)) == 8
+    with pytest.raises(RuntimeError, match="broken pipe"):
+        next(batches)
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("every_n_frames", [1, 3])
+def test_load_video_workers(gop_video, every_n_frames: int) -> None:
+    reference = _all_frames(gop_video)[::every_n_frames]
+    for workers in [2, 3, 7]:
+        frames = pjmstools.image.load_video(gop_video, every_n_frames=every_n_frames, workers=workers)
+        assert np.array_equal(frames, reference)
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("every_n_frames", [1, 2])
+def test_stream_video_workers(gop_video, every_n_frames: int) -> None:
+    batches = list(pjmstools.image.stream_video(gop_video, batch_size=4, every_n_frames=every_n_frames, workers=3))
+    assert all(len(batch) == 4 for batch in batches[:-1])
+    assert np.array_equal(np.concatenate(batches), _all_frames(gop_video)[::every_n_frames])
+
+
+@needs_ffmpeg
+@pytest.mark.parametrize("n_probed", [30, 1000])
+def test_load_video_workers_wrong_frame_count(gop_video, monkeypatch, n_probed: int) -> None:
+    monkeypatch.setattr(pjmstools.image.image, "_count_frames", lambda probe: n_probed)
+    assert np.array_equal(pjmstools.image.load_video(gop_video, workers=3), _all_frames(gop_video))
+    assert np.array_equal(
+        np.concatenate(list(pjmstools.image.stream_video(gop_video, batch_size=4, workers=3))), _all_frames(gop_video)
+    )
+
+
+@pytest.fixture(scope="module")
+def hyperstack() -> np.ndarray:
+    return np.random.default_rng(0).integers(0, 60000, (6, 3, 2, 32, 40), dtype=np.uint16)
+
+
+@pytest.mark.parametrize("kind", ["imagej", "ome-zlib"])
+def test_stream_tiff(tmp_path, hyperstack, kind: str) -> None:
+    path = tmp_path / "stack.ome.tif"
+    if kind == "imagej":
+        tifffile.imwrite(path, hyperstack, imagej=True, metadata={"axes": "TZCYX"})
+    else:
+        tifffile.imwrite(path, hyperstack, ome=True, metadata={"axes": "TZCYX"}, compression="zlib")
+    batches = list(pjmstools.image.stream_tiff(path, batch_size=2, axis="T", select={"Z": 1, "C": 0}, every_n_frames=2))
+    assert [batch.shape for batch in batches] == [(2, 32, 40), (1, 32, 40)]
+    assert np.array_equal(np.concatenate(batches), hyperstack[::2, 1, 0])
+
+    frames = pjmstools.image.load_tiff(path, axis="Z", select={"T": 4, "C": 1})
+    assert isinstance(frames, np.memmap) == (kind == "imagej")
+    assert np.array_equal(frames, hyperstack[4, :, 1])
+    assert not isinstance(pjmstools.image.load_tiff(path, axis="Z", select={"T": 4, "C": 1}, memmap=False), np.memmap)
+
+    with pytest.raises(ValueError):
+        pjmstools.image.load_tiff(path)
+
+
+def test_load_tiff_pages(tmp_path) -> None:
+    rgb = np.random.default_rng(1).integers(0, 255, (5, 20, 30, 3), dtype=np.uint8)
+    tifffile.imwrite(tmp_path / "rgb.tif", rgb, photometric="rgb")
+    assert np.array_equal(pjmstools.image.load_tiff(tmp_path / "rgb.tif", every_n_frames=2), rgb[::2])
+    tifffile.imwrite(tmp_path / "single.tif", rgb[0, ..., 0])
+    assert np.array_equal(pjmstools.image.load_tiff(tmp_path / "single.tif"), rgb[:1, ..., 0])
+
+
+@needs_ffmpeg
+def test_write_video_roundtrip(tmp_path, video) -> None:
+    path = tmp_path / "out.mkv"
+    # lossless codec, so frames come back exactly
+    n = pjmstools.image.write_video(
+        path, pjmstools.image.stream_video(video, batch_size=16, pix_fmt="gray"), codec="ffv1", pix_fmt="gray"
+    )
+    assert n == N_FRAMES
+    assert np.array_equal(pjmstools.image.load_video(path, pix_fmt="gray"), pjmstools.image.load_video(video, pix_fmt="gray"))
+
+
+@needs_ffmpeg
+def test_write_video_dtypes(tmp_path) -> None:
+    frames = np.random.default_rng(2).normal(size=(10, 21, 31, 3)) * 1000
+    path = tmp_path / "out.mkv"
+    pjmstools.image.write_video(path, frames, batch_size=4, normalize=True, codec="ffv1", pix_fmt="rgb24")
+    written = pjmstools.image.load_video(path)
+    # odd sizes are padded to even ones
+    assert written.shape == (10, 22, 32, 3)
+    expected = pjmstools.image.contrast_normalize(frames[8:], maxpx=255, dtype=np.uint8)
+    assert np.array_equal(written[8:, :21, :31], expected)
+
+    path = tmp_path / "out.mp4"
+    assert pjmstools.image.write_video(path, frames[..., 0].astype(np.uint16)) == 10
+    assert pjmstools.image.load_video(path).shape == (10, 22, 32, 3)
+
+
+@needs_ffmpeg
+def test_video_writer_rounds(tmp_path) -> None:
+    frames = np.full((2, 16, 16), 254.6)
+    frames[1] = 300.0
+    path = tmp_path / "out.mkv"
+    pjmstools.image.write_video(path, frames, codec="ffv1", pix_fmt="gray")
+    assert list(pjmstools.image.load_video(path, pix_fmt="gray")[:, 0, 0]) == [255, 255]
+
+
+@needs_ffmpeg
+def test_video_writer_keeps_original_error(tmp_path) -> None:
+    # ffmpeg fails on the unknown codec once its input is closed; that failure should not replace an error raised inside the block
+    with pytest.raises(ZeroDivisionError):
+        with pjmstools.image.VideoWriter(tmp_path / "out.mp4", codec="no_such_codec") as writer:
+            writer.write(np.zeros((2, 16, 16), np.uint8))
+            1 / 0
+    with pytest.raises(RuntimeError):
+        with pjmstools.image.VideoWriter(tmp_path / "out.mp4", codec="no_such_codec") as writer:
+            writer.write(np.zeros((2, 16, 16), np.uint8))
+
+
+@needs_ffmpeg
+def test_video_writer_shape_mismatch(tmp_path) -> None:
+    with pjmstools.image.VideoWriter(tmp_path / "out.mp4") as writer:
+        writer.write(np.zeros((2, 16, 16), np.uint8))
+        with pytest.raises(ValueError):
+            writer.write(np.zeros((2, 16, 18), np.uint8))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16, np.float32])
+def test_contrast_normalize(dtype) -> None:
+    image = np.random.default_rng(3).integers(10, 200, (7, 30, 40, 3)).astype(dtype)
+    low, high = image.min(), image.max()
+    expected = (image.astype(np.float64) - low) / (float(high) - float(low)) * 255
+    result = pjmstools.image.contrast_normalize(image)
+    assert result.dtype == (np.float32 if dtype == np.float32 else np.float64)
+    assert np.allclose(result, expected, rtol=1e-6)
+
+    as_uint8 = pjmstools.image.contrast_normalize(image, dtype=np.uint8)
+    assert as_uint8.dtype == np.uint8
+    assert np.array_equal(as_uint8, np.rint(expected))
+
+    # strided input (e.g. a view of a memmap) and in-place output
+    view = image[::2, :, ::3, 0]
+    out = view.copy()
+    assert pjmstools.image.contrast_normalize(out, maxpx=100, out=out) is out
+    low, high = view.min(), view.max()
+    expected = (view.astype(np.float64) - low) / (float(high) - float(low)) * 100
+    if dtype != np.float32:
+        expected = np.rint(expected)  # integer output is rounded
+    assert np.allclose(out, expected, rtol=1e-6)
+
+
+def test_contrast_normalize_constant() -> None:
+    assert not pjmstools.image.contrast_normalize(np.full((4, 4), 7, np.uint8)).any()
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.float64])
+def test_autocontrast(dtype) -> None:
+    image = np.random.default_rng(4).integers(0, 255, (5, 50, 60)).astype(dtype)
+    low, high = np.percentile(image, 2), np.percentile(image, 98)
+    expected = (np.clip(image, low, high) - low) / (high - low) * 255
+    assert np.allclose(pjmstools.image.autocontrast(image), expected)
+    assert np.array_equal(pjmstools.image.autocontrast(image, dtype=np.uint8), np.rint(expected))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.uint16])
+def test_histogram_percentiles(dtype) -> None:
+    info = np.iinfo(dtype)
+    image = np.random.default_rng(5).integers(info.min, info.max, (4, 33, 17), endpoint=True).astype(dtype)
+    qs = (0, 2, 37.5, 98, 100)
+    assert np.allclose(pjmstools.image.image._percentiles(image, qs), np.percentile(image, qs))
+    per_frame = pjmstools.image.image._percentiles(image, qs, per_frame=True)
+    assert np.allclose(per_frame, np.percentile(image.reshape(4, -1), qs, axis=1))
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.float32])
+def test_autocontrast_per_frame(dtype) -> None:
+    rng = np.random.default_rng(6)
+    # frames with very different brightness
+    image = (rng.integers(0, 50, (3, 40, 40)) * np.array([1, 2, 5])[:, None, None]).astype(dtype)
+    result = pjmstools.image.autocontrast(image, mode="frame", dtype=np.uint8)
+    for frame, frame_result in zip(image, result):
+        assert np.array_equal(frame_result, pjmstools.image.autocontrast(frame, dtype=np.uint8))
+    with pytest.raises(ValueError):
+        pjmstools.image.autocontrast(image, mode="video")
+
+
+def test_running_autocontrast() -> None:
+    stack = np.random.default_rng(7).integers(0, 4096, (20, 30, 30)).astype(np.uint16)
+    running = pjmstools.image.RunningAutocontrast(cliprange=1, maxpx=4095, dtype=np.uint16)
+    batches = [running(batch) for batch in np.split(stack, 4)]
+    # after the last batch the clip points are those of the whole stack, so the last batch is mapped like the whole stack would be
+    assert np.allclose(running.limits, np.percentile(stack, [1, 99]))
+    whole = pjmstools.image.autocontrast(stack, cliprange=1, maxpx=4095, dtype=np.uint16)
+    assert np.array_equal(batches[-1], whole[15:])
+
+    running = pjmstools.image.RunningAutocontrast()
+    for batch in np.split(stack.astype(np.float64), 4):
+        running.update(batch)
+    assert np.allclose(running.limits, np.percentile(stack, [2, 98]), rtol=0.05)
@@ -0,0 +1,52 @@
+import subprocess
+import sys
+
+import pjmstools
+
+# Heavy dependencies that must not be pulled in by a bare `import pjmstools`.
+HEAVY_MODULES = ("pandas", "scipy", "matplotlib", "ffmpeg", "multiprocessing")
+# Generous budget (in seconds) for importing pjmstools on top of numpy.
+IMPORT_TIME_BUDGET = 0.5
+
+
+def _run(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _cumulative_import_time(stderr: str, module: str) -> float:
+    """Cumulative import time in seconds of `module`, parsed from -X importtime output."""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise ValueError(f"{module} not found in importtime output")
+
+
+def test_import_does_not_load_heavy_dependencies() -> None:
+    proc = _run(
+        "import sys, pjmstools; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    assert proc.stdout.strip() == ""
+
+
+def test_import_time_budget() -> None:
+    # numpy is imported first, so its (unavoidable) cost is not counted.
+    proc = _run("import numpy; import pjmstools")
+    elapsed = _cumulative_import_time(proc.stderr, "pjmstools")
+    print(f"import pjmstools: {elapsed * 1e3:.1f} ms")
+    assert elapsed < IMPORT_TIME_BUDGET
+
+
+def test_lazy_submodules_still_accessible() -> None:
+    assert "image" in dir(pjmstools)
+    assert callable(pjmstools.image.stream_video)
+    assert callable(pjmstools.plot.squarify)
+    assert callable(pjmstools.flatten)